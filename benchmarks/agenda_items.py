@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import re
+import sys
+import time
+
+import klupung.ktweb
+
+from klupung.ktweb import _RE_DNRO, _RE_PERSON, _RE_RESOLUTION, _trimws
+
+# The original field extractors, each scanning all paragraphs of the
+# agenda item, kept as the reference the single-pass extractor must
+# agree with.
+
+def _parse_agenda_item_resolution(agenda_item_soup):
+    resolutions = [(None, None)]
+
+    proposal = None
+
+    for p in agenda_item_soup.html.body("p"):
+        resolution_match = _RE_RESOLUTION.match(p.text)
+        if resolution_match:
+            resolution = "<p>%s</p>" % _trimws(resolution_match.group(1))
+            resolutions.append((proposal, resolution))
+            proposal = None
+            continue
+
+        if "Ehdotus" in p.attrs.get("class", []):
+            if proposal is None:
+                proposal = ""
+            continue
+
+        if proposal is not None:
+            text = _trimws(p.text)
+            if text:
+                proposal += "<p>%s</p>" % text
+
+    return resolutions[-1]
+
+def _parse_agenda_item_preparers(agenda_item_soup):
+    preparers = []
+    for text in [_trimws(p.text) for p in agenda_item_soup("p")]:
+        if text.startswith("Asian valmisteli"):
+            preparers.extend(_RE_PERSON.findall(text))
+            break
+    return preparers
+
+def _parse_agenda_item_introducers(agenda_item_soup):
+    introducers = []
+    for text in [_trimws(p.text) for p in agenda_item_soup("p")]:
+        if text.startswith("Asian esitteli"):
+            introducers.extend(_RE_PERSON.findall(text))
+            break
+    return introducers
+
+def _parse_agenda_item_dnro(agenda_item_soup):
+    ps = agenda_item_soup.html.body("p")
+    dnros = []
+    for text in [_trimws(p.text) for p in ps]:
+        dnro_match = _RE_DNRO.match(text)
+        if dnro_match:
+            dnros.append(dnro_match.group(1))
+
+    try:
+        dnro = dnros[0]
+    except IndexError:
+        dnro = None
+
+    if dnro == "0/00":
+        dnro = None
+
+    return dnro
+
+def _parse_agenda_item_subject(agenda_item_soup, number):
+    number_found = False
+    for p in agenda_item_soup.html.body("p"):
+        text = _trimws(p.text)
+        if not number_found:
+            match = re.match(r"%d$|%d " % (number, number), text)
+            if match:
+                number_found = True
+                subject_candidate = text[match.end():].strip()
+                if subject_candidate:
+                    return subject_candidate
+        else:
+            subject_candidate = text.strip()
+            if subject_candidate:
+                return subject_candidate
+    return None
+
+def multiscan(agenda_item_soup, number):
+    proposal, resolution = _parse_agenda_item_resolution(agenda_item_soup)
+    return {
+        "subject": _parse_agenda_item_subject(agenda_item_soup, number),
+        "dnro": _parse_agenda_item_dnro(agenda_item_soup),
+        "preparers": _parse_agenda_item_preparers(agenda_item_soup),
+        "introducers": _parse_agenda_item_introducers(agenda_item_soup),
+        "proposal": proposal,
+        "resolution": resolution,
+        }
+
+def single_pass(agenda_item_soup, number):
+    return klupung.ktweb._parse_agenda_item_paragraphs(agenda_item_soup,
+                                                       number)
+
+EXTRACTORS = (
+    ("multi-scan", multiscan),
+    ("single pass", single_pass),
+    )
+
+def iter_agenda_item_soups(dirpath):
+    # Yields (meeting document dirpath, filename, number, soup) of all
+    # agenda items in meeting document directories and packs in DIR.
+    for meeting_document_dirpath in sorted(
+        klupung.ktweb.iter_meeting_document_dirpaths(dirpath)):
+        with klupung.ktweb.open_meeting_document(
+            meeting_document_dirpath) as meeting_document:
+            for filename in sorted(meeting_document.namelist()):
+                match = re.match(r"htmtxt([0-9]+)\.htm$", filename)
+                if not match or filename == "htmtxt0.htm":
+                    continue
+                soup = klupung.ktweb._make_soup(meeting_document.read(filename))
+                yield (meeting_document_dirpath, filename,
+                       int(match.group(1)), soup)
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Measure the per-item cost of extracting agenda item "
+        "fields from the agenda items in DIR with the original multi-scan "
+        "extractors and with the single-pass extractor, and check that "
+        "they agree.")
+
+    arg_parser.add_argument(
+        "ktweb_dir",
+        metavar="DIR",
+        help="KTWeb root directory")
+
+    arg_parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=3,
+        help="run each extractor N times per agenda item and take the "
+        "fastest, default: %(default)s")
+
+    args = arg_parser.parse_args()
+
+    times = dict((name, 0.0) for name, _ in EXTRACTORS)
+    item_count = 0
+    mismatches = []
+
+    for dirpath, filename, number, soup in iter_agenda_item_soups(
+        args.ktweb_dir):
+        item_count += 1
+        expected = None
+        for name, extractor in EXTRACTORS:
+            best_time = None
+            for _ in range(args.repeat):
+                start_time = time.time()
+                fields = extractor(soup, number)
+                elapsed_time = time.time() - start_time
+                if best_time is None or elapsed_time < best_time:
+                    best_time = elapsed_time
+            times[name] += best_time
+            if expected is None:
+                expected = fields
+            elif fields != expected:
+                mismatches.append((name, dirpath, filename))
+
+    if not item_count:
+        print("error: no agenda items found from %s" % args.ktweb_dir,
+              file=sys.stderr)
+        return 1
+
+    print("%d agenda items" % item_count)
+    print("%-12s %12s %8s" % ("extractor", "ms/item", "speedup"))
+    for name, _ in EXTRACTORS:
+        print("%-12s %12.3f %7.2fx" % (
+                name,
+                1000 * times[name] / item_count,
+                times["multi-scan"] / times[name]))
+
+    for name, dirpath, filename in mismatches:
+        print("error: %s fields differ from multi-scan fields: %s/%s" %
+              (name, dirpath, filename), file=sys.stderr)
+
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
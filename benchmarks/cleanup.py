@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import os
+import os.path
+import re
+import sys
+import time
+
+import bs4
+
+import klupung.ktweb
+
+def cleanup_soup_multiscan(soup):
+    # The original sanitizer, kept as the reference the others must
+    # agree with.
+    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Comment)):
+        tag.extract()
+
+    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Declaration)):
+        tag.extract()
+
+    for tag in soup("style"):
+        tag.extract()
+
+    for tag in soup("meta"):
+        tag.extract()
+
+    for tag in soup.find_all():
+        attrs = tag.attrs
+        saved_attrs = set(["class", "href", "target"]) & set(attrs.keys())
+        tag.attrs = {a: attrs[a] for a in saved_attrs}
+
+    for tag in soup.find_all(text=True):
+        tag.replace_with(re.sub(r"\r", "", tag.string))
+
+    return soup
+
+def multiscan(markup, encoding, features):
+    return cleanup_soup_multiscan(
+        bs4.BeautifulSoup(markup, features, from_encoding=encoding))
+
+def single_walk(markup, encoding, features):
+    return klupung.ktweb._cleanup_soup(
+        bs4.BeautifulSoup(markup, features, from_encoding=encoding))
+
+def stream(markup, encoding, features):
+    return klupung.ktweb._CleanSoup(markup, features, from_encoding=encoding)
+
+def parse_only(markup, encoding, features):
+    return bs4.BeautifulSoup(markup, features, from_encoding=encoding)
+
+SANITIZERS = (
+    ("parse only", parse_only),
+    ("multi-scan", multiscan),
+    ("single walk", single_walk),
+    ("stream", stream),
+    )
+
+def iter_pages(dirpath):
+    # Yields (filepath, markup, encoding) of raw pages stored with
+    # 'klupung-download-ktweb --raw', or of clean pages if the
+    # directory has no raw pages.
+    raw_pages = []
+    clean_pages = []
+    for dirpath, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            if filename.endswith(".htm.raw"):
+                raw_pages.append(filepath)
+            elif filename.endswith(".htm"):
+                clean_pages.append(filepath)
+
+    for filepath in raw_pages:
+        clean_filepath = filepath[:-len(".raw")]
+        with open(clean_filepath + ".encoding") as f:
+            encoding = f.readline().strip()
+        with open(filepath, "rb") as f:
+            yield filepath, f.read(), encoding
+
+    if raw_pages:
+        return
+
+    for filepath in clean_pages:
+        with open(filepath, "rb") as f:
+            yield filepath, f.read(), "utf-8"
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Measure the per-page cost of KTWeb page sanitizers "
+        "on pages in DIR and check that they all agree with the original "
+        "multi-scan sanitizer.")
+
+    arg_parser.add_argument(
+        "ktweb_dir",
+        metavar="DIR",
+        help="KTWeb root directory")
+
+    arg_parser.add_argument(
+        "--features",
+        metavar="FEATURES",
+        default=None,
+        help="BeautifulSoup tree builder features, e.g. 'html.parser' or "
+        "'lxml', default: BeautifulSoup's default")
+
+    arg_parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=3,
+        help="measure each sanitizer N times per page and take the "
+        "fastest, default: %(default)s")
+
+    args = arg_parser.parse_args()
+
+    times = dict((name, 0.0) for name, _ in SANITIZERS)
+    page_count = 0
+    byte_count = 0
+    mismatches = []
+
+    for filepath, markup, encoding in iter_pages(args.ktweb_dir):
+        page_count += 1
+        byte_count += len(markup)
+        expected = None
+        for name, sanitizer in SANITIZERS:
+            best_time = None
+            for _ in range(args.repeat):
+                start_time = time.time()
+                soup = sanitizer(markup, encoding, args.features)
+                elapsed_time = time.time() - start_time
+                if best_time is None or elapsed_time < best_time:
+                    best_time = elapsed_time
+            times[name] += best_time
+            if name == "parse only":
+                continue
+            output = unicode(soup)
+            if expected is None:
+                expected = output
+            elif output != expected:
+                mismatches.append((name, filepath))
+
+    if not page_count:
+        print("error: no pages found from %s" % args.ktweb_dir,
+              file=sys.stderr)
+        return 1
+
+    print("%d pages, %d bytes, features: %s" %
+          (page_count, byte_count, args.features or "default"))
+    print("%-12s %12s %16s %8s" % ("sanitizer", "ms/page",
+                                    "cleanup ms/page", "speedup"))
+    parse_time = times["parse only"]
+    for name, _ in SANITIZERS:
+        total_time = times[name]
+        cleanup_time = total_time - parse_time
+        if name == "parse only":
+            speedup = ""
+        else:
+            speedup = "%.2fx" % (times["multi-scan"] / total_time)
+        print("%-12s %12.3f %16.3f %8s" % (
+                name,
+                1000 * total_time / page_count,
+                1000 * cleanup_time / page_count,
+                speedup))
+
+    for name, filepath in mismatches:
+        print("error: %s output differs from multi-scan output: %s" %
+              (name, filepath), file=sys.stderr)
+
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import urlparse
+
+import klupung.httppool
+import klupung.instrumentation
+import klupung.ktweb
+import klupung.manifest
+import klupung.retry
+import klupung.revalidation
+
+import fake_ktweb
+
+def _run(policymaker_urls, download_dir, state_dir, args):
+    connection_pool = klupung.httppool.ConnectionPool(
+        maxsize=args.max_requests_in_flight)
+    klupung.ktweb.set_connection_pool(connection_pool)
+    download_stats = klupung.instrumentation.DownloadStats()
+    klupung.ktweb.set_instrumentation(download_stats)
+
+    revalidation_store = None
+    if args.revalidation_cache:
+        revalidation_store = klupung.revalidation.RevalidationStore(
+            os.path.join(state_dir, "revalidation.db"))
+
+    manifest = None
+    if args.manifest:
+        manifest = klupung.manifest.CrawlManifest(
+            os.path.join(state_dir, "manifest.db"))
+
+    retry_queue = None
+    if args.max_attempts > 1:
+        retry_queue = klupung.retry.RetryQueue(max_attempts=args.max_attempts,
+                                               initial_delay=args.retry_delay,
+                                               max_delay=args.retry_delay * 8)
+
+    meeting_document_count = 0
+    start_time = time.time()
+    for meeting_document_dir in klupung.ktweb.download_policymakers(
+        policymaker_urls, min_interval=args.min_request_interval,
+        burst=args.burst, download_dir=download_dir,
+        max_workers=args.max_requests_in_flight,
+        revalidation_store=revalidation_store, manifest=manifest,
+        retry_queue=retry_queue, raw=args.raw):
+        if meeting_document_dir is not None:
+            meeting_document_count += 1
+    wall_time = time.time() - start_time
+
+    if revalidation_store is not None:
+        revalidation_store.close()
+    if manifest is not None:
+        manifest.close()
+    connection_pool.close()
+
+    total = download_stats.summarize()[-1]
+    stages = total["stages"]
+    return {
+        "wall_time": wall_time,
+        "meeting_document_count": meeting_document_count,
+        "request_count": connection_pool.request_count,
+        "page_count": total["requests"].get("200", 0),
+        "byte_count": total["bytes"],
+        "throttle_time": stages["throttle"]["total"],
+        "network_time": stages["network"]["total"],
+        "parse_time": stages["parse"]["total"],
+        "write_time": stages["write"]["total"],
+        "dead_letter_count": len(retry_queue.dead_letters) if retry_queue else 0,
+        }
+
+def _print_result(run_number, result):
+    wall_time = result["wall_time"]
+    print("run %d: %d meeting documents, %d requests, %d pages, %d bytes "
+          "in %.2f s" % (run_number, result["meeting_document_count"],
+                         result["request_count"], result["page_count"],
+                         result["byte_count"], wall_time))
+    print("  %.1f pages/s, %.0f bytes/s" % (result["page_count"] / wall_time,
+                                           result["byte_count"] / wall_time))
+    # Thread times are summed over all workers and can exceed the wall
+    # time when downloading concurrently.
+    print("  thread time: throttle %.2f s, network %.2f s, parse %.2f s, "
+          "write %.2f s" % (result["throttle_time"], result["network_time"],
+                            result["parse_time"], result["write_time"]))
+    if result["dead_letter_count"]:
+        print("  %d meeting documents gave up" % result["dead_letter_count"])
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark klupung.ktweb.download_policymakers() against "
+        "a local fake KTweb server serving a synthetic KTweb tree (or DIR "
+        "given with --tree) and report pages/s, bytes/s and the time spent "
+        "throttling, on network, parsing and writing.")
+
+    fake_ktweb.add_tree_arguments(arg_parser)
+    fake_ktweb.add_server_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "--tree",
+        metavar="DIR",
+        help="serve an existing KTweb tree instead of generating one")
+
+    arg_parser.add_argument(
+        "--listing",
+        metavar="PATH",
+        action="append",
+        help="policymaker listing path relative to --tree DIR, e.g. "
+        "paatokset/kh.htm, can be given multiple times")
+
+    arg_parser.add_argument(
+        "--runs",
+        type=int,
+        default=1,
+        help="number of consecutive downloads to the same directory, later "
+        "runs measure incremental downloads, default=1")
+
+    arg_parser.add_argument(
+        "--min-request-interval",
+        type=float,
+        default=0.0,
+        help="minimum HTTP request interval in seconds, default=0.0")
+
+    arg_parser.add_argument(
+        "--burst",
+        type=int,
+        default=1,
+        help="see klupung-download-ktweb, default=1")
+
+    arg_parser.add_argument(
+        "--max-requests-in-flight",
+        type=int,
+        default=1,
+        help="see klupung-download-ktweb, default=1")
+
+    arg_parser.add_argument(
+        "--revalidation-cache",
+        action="store_true",
+        default=False,
+        help="use a revalidation cache")
+
+    arg_parser.add_argument(
+        "--manifest",
+        action="store_true",
+        default=False,
+        help="use a crawl manifest")
+
+    arg_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=1,
+        help="see klupung-download-ktweb, default=1")
+
+    arg_parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=0.1,
+        help="delay before the first retry in seconds, default=0.1")
+
+    arg_parser.add_argument(
+        "--raw",
+        action="store_true",
+        default=False,
+        help="download in raw mode")
+
+    arg_parser.add_argument(
+        "--keep",
+        action="store_true",
+        default=False,
+        help="keep the temporary directory")
+
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="klupung-crawl-")
+    try:
+        if args.tree:
+            tree_dir = args.tree
+            listing_relpaths = args.listing or []
+        else:
+            tree_dir = os.path.join(tmp_dir, "tree")
+            listing_relpaths = fake_ktweb.generate_tree_from_args(tree_dir,
+                                                                  args)
+        if not listing_relpaths:
+            arg_parser.error("--tree requires at least one --listing")
+
+        server = fake_ktweb.FakeKTwebServer(tree_dir, latency=args.latency,
+                                            latency_jitter=args.latency_jitter,
+                                            error_rate=args.error_rate)
+        server.start()
+        try:
+            policymaker_urls = [urlparse.urljoin(server.url, relpath)
+                                for relpath in listing_relpaths]
+            download_dir = os.path.join(tmp_dir, "download")
+            for run_number in range(1, args.runs + 1):
+                result = _run(policymaker_urls, download_dir, tmp_dir, args)
+                _print_result(run_number, result)
+        finally:
+            server.stop()
+        print("server: %s" % server.format_stats())
+    finally:
+        if args.keep:
+            print("kept %s" % tmp_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(tmp_dir)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for the geocoder.
+
+Answers agenda item pages posted to /document/html/<city> like the
+geocoder does, with a JSON list of the addresses found in them, with
+configurable latency and error rate. The coordinates are made up from
+the addresses.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import BaseHTTPServer
+import hashlib
+import json
+import random
+import re
+import socket
+import SocketServer
+import sys
+import threading
+import time
+
+import fake_ktweb
+
+_RE_ADDRESS = re.compile(
+    ur"\b([A-ZÅÄÖ][a-zåäö]*(?:katu|tie|polku|kuja|väylä|rinne|kaari)) ([0-9]+)\b",
+    re.UNICODE)
+
+def _geocode(text):
+    geometries = []
+    for street, number in _RE_ADDRESS.findall(text):
+        name = u"%s %s" % (street, number)
+        digest = hashlib.md5(name.encode("utf-8")).digest()
+        geometries.append({
+                "name": name,
+                "category": "address",
+                "type": "Point",
+                "coordinates": [25.5 + ord(digest[0]) / 1000,
+                                62.1 + ord(digest[1]) / 1000],
+                })
+    return geometries
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_response(self, status, data=""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+        latency, is_error = server.draw()
+        time.sleep(latency)
+
+        if is_error:
+            server.count("error_count")
+            self._send_response(503)
+            return
+
+        if not self.path.startswith("/document/html/"):
+            server.count("not_found_count")
+            self._send_response(404)
+            return
+
+        server.count("ok_count", len(body))
+        self._send_response(200, json.dumps(
+                _geocode(body.decode("utf-8", "replace"))))
+
+class FakeGeocoderServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    """HTTP server geocoding posted agenda items.
+
+    Latency and errors are drawn like in fake_ktweb.FakeKTwebServer.
+    Port 0 picks a free port, see `url`.
+
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address="127.0.0.1", port=0, latency=0.0,
+                 latency_jitter=0.0, error_rate=0.0, seed=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port),
+                                           _RequestHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.ok_count = 0
+        self.not_found_count = 0
+        self.error_count = 0
+        self.byte_count = 0
+
+    @property
+    def url(self):
+        return "http://%s:%d/document/html" % self.server_address[:2]
+
+    def draw(self):
+        with self._lock:
+            latency = self.latency + self.latency_jitter * self._random.random()
+            is_error = self._random.random() < self.error_rate
+        return latency, is_error
+
+    def count(self, counter_name, byte_count=0):
+        with self._lock:
+            setattr(self, counter_name, getattr(self, counter_name) + 1)
+            self.byte_count += byte_count
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+    def format_stats(self):
+        return ("%d ok (%d bytes received), %d not found, %d errors" % (
+                self.ok_count, self.byte_count, self.not_found_count,
+                self.error_count))
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Serve a fake geocoder, e.g. for "
+        "'klupung-geocode-ktweb --geocoder-url'.")
+    arg_parser.add_argument(
+        "--address",
+        default="127.0.0.1",
+        help="listen address, default=127.0.0.1")
+    arg_parser.add_argument(
+        "--port",
+        type=int,
+        default=3000,
+        help="listen port, default=3000")
+    fake_ktweb.add_server_arguments(arg_parser)
+
+    args = arg_parser.parse_args()
+
+    server = FakeGeocoderServer(address=args.address, port=args.port,
+                                latency=args.latency,
+                                latency_jitter=args.latency_jitter,
+                                error_rate=args.error_rate)
+    print("Geocoding at %s" % server.url, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.format_stats(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
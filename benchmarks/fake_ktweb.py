@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-in for a KTweb server.
+
+Generates synthetic KTweb trees (policymaker listings, meeting document
+indices, cover pages and agenda items laid out and encoded like the
+real ones) and serves them, or any recorded tree, over HTTP with
+configurable latency and error rate.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import BaseHTTPServer
+import codecs
+import datetime
+import email.utils
+import hashlib
+import os
+import os.path
+import random
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+
+_FIRST_NAMES = [u"Matti", u"Maija", u"Pekka", u"Liisa", u"Jukka",
+                u"Anna-Kaisa", u"Ville", u"Sari"]
+_LAST_NAMES = [u"Meikäläinen", u"Virtanen", u"Korhonen", u"Mäkinen",
+               u"Nieminen", u"Hämäläinen", u"Laine", u"Heikkinen"]
+_WORDS = [u"kaupunki", u"asemakaava", u"muutos", u"hyväksyminen",
+          u"talousarvio", u"vuokrasopimus", u"lausunto", u"päiväkoti",
+          u"katusuunnitelma", u"Kortepohja", u"Kuokkala", u"Keljo",
+          u"investointi", u"hankinta", u"palvelu", u"toimiala", u"tontti",
+          u"korttelissa"]
+_WEEKDAYS = [u"Maanantai", u"Tiistai", u"Keskiviikko", u"Torstai",
+             u"Perjantai", u"Lauantai", u"Sunnuntai"]
+
+_PAGE_TEMPLATE = u"""\
+<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN">\r
+<html>\r
+<head>\r
+<meta http-equiv="Content-Type" content="text/html; charset=%(charset)s">\r
+<title>%(title)s</title>\r
+<style type="text/css">\r
+p.Ehdotus { font-weight: bold }\r
+</style>\r
+</head>\r
+<body bgcolor="#FFFFFF" lang="FI">\r
+<!-- KTweb -->\r
+%(body)s</body>\r
+</html>\r
+"""
+
+_COVER_PAGE_BODY_TEMPLATE = u"""\
+<table border="0" width="100%%">\r
+<tr><td valign="top"><p><b>KOKOUSTIEDOT</b></p></td>\r
+<td><p>%(weekday)s %(day)d.%(month)d.%(year)d klo %(hour)d.%(minute)02d</p>\
+<p>Kaupungintalo</p></td></tr>\r
+</table>\r
+<table border="0">\r
+<tr><td><p><b>PÖYTÄKIRJA YLEISESTI NÄHTÄVILLÄ</b></p></td>\r
+<td><p>Ilmoitustaululla %(publish_day)d.%(publish_month)d.%(publish_year)d\
+</p></td></tr>\r
+</table>\r
+"""
+
+def _page(title, body, charset):
+    return _PAGE_TEMPLATE % {"charset": charset, "title": title, "body": body}
+
+def _person(rnd):
+    return u"%s %s" % (rnd.choice(_FIRST_NAMES), rnd.choice(_LAST_NAMES))
+
+def _sentence(rnd, word_count):
+    words = [rnd.choice(_WORDS) for _ in range(word_count)]
+    return (u" ".join(words) + u".").capitalize()
+
+def _agenda_item_page(rnd, number, paragraph_count):
+    body = []
+    body.append(u'<p class="Otsikko" style="margin-left: 0">%d %s</p>\r\n' %
+                (number, _sentence(rnd, 4)))
+    if rnd.random() > 0.2:
+        body.append(u'<p class="Dnro">Dnro %d/%d</p>\r\n' %
+                    (rnd.randint(1, 5000), rnd.randint(2008, 2014)))
+    for _ in range(paragraph_count):
+        body.append(u'<p class="Leipa" align="left">%s</p>\r\n' %
+                    _sentence(rnd, rnd.randint(8, 40)))
+    body.append(u'<p class="Ehdotus">Ehdotus</p>\r\n')
+    body.append(u'<p>Ehdotus %s</p>\r\n' % _sentence(rnd, 12))
+    body.append(u'<p>&nbsp;</p>\r\n')
+    body.append(u'<p class="Paatos">Päätös %s</p>\r\n' % _sentence(rnd, 10))
+    body.append(u'<p>Asian valmisteli %s, puh. 014 266 %04d</p>\r\n' %
+                (_person(rnd), rnd.randint(0, 9999)))
+    body.append(u'<p>Asian esitteli %s</p>\r\n' % _person(rnd))
+    return _page(u"Pöytäkirja %d" % number, u"".join(body), "windows-1252")
+
+def _cover_page(start_datetime, publish_date):
+    body = _COVER_PAGE_BODY_TEMPLATE % {
+        "weekday": _WEEKDAYS[start_datetime.weekday()],
+        "day": start_datetime.day,
+        "month": start_datetime.month,
+        "year": start_datetime.year,
+        "hour": start_datetime.hour,
+        "minute": start_datetime.minute,
+        "publish_day": publish_date.day,
+        "publish_month": publish_date.month,
+        "publish_year": publish_date.year,
+        }
+    return _page(u"Kansilehti", body, "windows-1252")
+
+def _index_page(agenda_item_numbers):
+    rows = [u'<tr><td width="10%%">%d</td><td><a href="htmtxt%d.htm">'
+            u'Asia %d</a></td></tr>\r\n' % (n, n, n)
+            for n in agenda_item_numbers]
+    body = (u'<table border="1">\r\n'
+            u'<tr><td>Asia</td><td>Otsikko</td></tr>\r\n'
+            + u"".join(rows) + u"</table>\r\n")
+    return _page(u"Pöytäkirja", body, "iso-8859-1")
+
+def _policymaker_page(abbreviation, index_relpaths):
+    body = []
+    for index_relpath in index_relpaths:
+        body.append(u'<h3><a href="%s">Pöytäkirja</a></h3>\r\n' %
+                    index_relpath)
+        # Agendas are listed as well but never downloaded.
+        body.append(u'<h3><a href="%s">Esityslista</a></h3>\r\n' %
+                    index_relpath.replace("index.htm", "esitys.htm"))
+    return _page(abbreviation, u"".join(body), "windows-1252")
+
+def _write(filepath, text, encoding):
+    dirpath = os.path.dirname(filepath)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+    with codecs.open(filepath, "w", encoding=encoding) as f:
+        f.write(text)
+
+def generate_tree(root, policymakers=("kh", "kv"), years=(2013,),
+                  meetings_per_year=10, agenda_items_per_meeting=10,
+                  seed=0):
+    """Generate a synthetic KTweb tree to `root`.
+
+    Returns the list of policymaker listing paths relative to `root`.
+
+    """
+
+    rnd = random.Random(seed)
+    listing_relpaths = []
+    for abbreviation in policymakers:
+        index_relpaths = []
+        for year in years:
+            for i in range(min(meetings_per_year, 52)):
+                start_datetime = (datetime.datetime(year, 1, 1, 16, 0)
+                                  + datetime.timedelta(days=7 * i))
+                publish_date = start_datetime + datetime.timedelta(days=7)
+                dirname = start_datetime.strftime("%d%m%H%M")
+                index_relpaths.append("%s/%d/%s/index.htm" %
+                                      (abbreviation, year, dirname))
+                dirpath = os.path.join(root, "paatokset", abbreviation,
+                                       str(year), dirname)
+                first_number = rnd.randint(1, 200)
+                numbers = range(first_number,
+                                first_number + agenda_items_per_meeting)
+                _write(os.path.join(dirpath, "index.htm"),
+                       _index_page(numbers), "iso-8859-1")
+                _write(os.path.join(dirpath, "htmtxt0.htm"),
+                       _cover_page(start_datetime, publish_date),
+                       "windows-1252")
+                for number in numbers:
+                    _write(os.path.join(dirpath, "htmtxt%d.htm" % number),
+                           _agenda_item_page(rnd, number,
+                                             rnd.randint(3, 30)),
+                           "windows-1252")
+        listing_relpath = "paatokset/%s.htm" % abbreviation
+        _write(os.path.join(root, listing_relpath),
+               _policymaker_page(abbreviation, index_relpaths),
+               "windows-1252")
+        listing_relpaths.append(listing_relpath)
+    return listing_relpaths
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately, do not let Nagle's
+        # algorithm and delayed ACKs add their own latency.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _translate_path(self):
+        path = urllib.unquote(self.path.split("?", 1)[0])
+        relpath = os.path.normpath(path).lstrip("/")
+        if relpath.startswith(".."):
+            return None
+        filepath = os.path.join(self.server.root, relpath)
+        # Trees recorded with 'klupung-download-ktweb --raw' have the
+        # pages as they were received in <page>.raw.
+        if os.path.isfile(filepath + ".raw"):
+            return filepath + ".raw"
+        return filepath
+
+    def _send_empty_response(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        latency, is_error = server.draw()
+        time.sleep(latency)
+
+        if is_error:
+            server.count("error_count")
+            self._send_empty_response(503)
+            return
+
+        filepath = self._translate_path()
+        if filepath is None or not os.path.isfile(filepath):
+            server.count("not_found_count")
+            self._send_empty_response(404)
+            return
+
+        with open(filepath, "rb") as f:
+            data = f.read()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        last_modified = email.utils.formatdate(os.path.getmtime(filepath),
+                                               usegmt=True)
+        validator_headers = (("ETag", etag), ("Last-Modified", last_modified))
+
+        if_none_match = self.headers.getheader("If-None-Match")
+        if_modified_since = self.headers.getheader("If-Modified-Since")
+        if ((if_none_match is not None and if_none_match == etag)
+            or (if_none_match is None and if_modified_since == last_modified)):
+            server.count("not_modified_count")
+            self._send_empty_response(304, validator_headers)
+            return
+
+        server.count("ok_count", len(data))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in validator_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeKTwebServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server serving a KTweb tree from `root`.
+
+    Each request is delayed by `latency` seconds plus a uniformly
+    random extra of at most `latency_jitter` seconds, and answered with
+    503 Service Unavailable with probability `error_rate`. Responses
+    carry ETag and Last-Modified headers, and conditional requests are
+    answered with 304 Not Modified. Port 0 picks a free port, see
+    `url`.
+
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, address="127.0.0.1", port=0, latency=0.0,
+                 latency_jitter=0.0, error_rate=0.0, seed=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port),
+                                           _RequestHandler)
+        self.root = root
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.ok_count = 0
+        self.not_modified_count = 0
+        self.not_found_count = 0
+        self.error_count = 0
+        self.byte_count = 0
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address[:2]
+
+    def draw(self):
+        with self._lock:
+            latency = self.latency + self.latency_jitter * self._random.random()
+            is_error = self._random.random() < self.error_rate
+        return latency, is_error
+
+    def count(self, counter_name, byte_count=0):
+        with self._lock:
+            setattr(self, counter_name, getattr(self, counter_name) + 1)
+            self.byte_count += byte_count
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+    def format_stats(self):
+        return ("%d ok (%d bytes), %d not modified, %d not found, "
+                "%d errors" % (self.ok_count, self.byte_count,
+                               self.not_modified_count, self.not_found_count,
+                               self.error_count))
+
+def add_server_arguments(arg_parser):
+    arg_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="delay of each response in seconds, default=0.0")
+
+    arg_parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.0,
+        help="maximum random extra delay of each response in seconds, "
+        "default=0.0")
+
+    arg_parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="probability of answering 503 Service Unavailable, default=0.0")
+
+def add_tree_arguments(arg_parser):
+    arg_parser.add_argument(
+        "--policymakers",
+        default="kh,kv",
+        help="comma-separated policymaker abbreviations, default=kh,kv")
+
+    arg_parser.add_argument(
+        "--years",
+        default="2013",
+        help="comma-separated years, default=2013")
+
+    arg_parser.add_argument(
+        "--meetings-per-year",
+        type=int,
+        default=10,
+        help="meeting documents per policymaker and year (at most 52), "
+        "default=10")
+
+    arg_parser.add_argument(
+        "--agenda-items-per-meeting",
+        type=int,
+        default=10,
+        help="agenda items per meeting document, default=10")
+
+    arg_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed, default=0")
+
+def generate_tree_from_args(root, args):
+    return generate_tree(
+        root,
+        policymakers=args.policymakers.split(","),
+        years=[int(year) for year in args.years.split(",")],
+        meetings_per_year=args.meetings_per_year,
+        agenda_items_per_meeting=args.agenda_items_per_meeting,
+        seed=args.seed)
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Generate a synthetic KTweb tree or serve a KTweb tree "
+        "over HTTP.")
+    subparsers = arg_parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser(
+        "generate",
+        help="generate a synthetic KTweb tree to DIR and print the paths of "
+        "its policymaker listings")
+    generate_parser.add_argument("root", metavar="DIR")
+    add_tree_arguments(generate_parser)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="serve the KTweb tree in DIR, e.g. one generated with "
+        "'generate' or downloaded with 'klupung-download-ktweb --raw' "
+        "(policymaker listings are not downloaded and must be added)")
+    serve_parser.add_argument("root", metavar="DIR")
+    serve_parser.add_argument(
+        "--address",
+        default="127.0.0.1",
+        help="listen address, default=127.0.0.1")
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="listen port, default=8000")
+    add_server_arguments(serve_parser)
+
+    args = arg_parser.parse_args()
+
+    if args.command == "generate":
+        for listing_relpath in generate_tree_from_args(args.root, args):
+            print(listing_relpath)
+        return 0
+
+    server = FakeKTwebServer(args.root, address=args.address, port=args.port,
+                             latency=args.latency,
+                             latency_jitter=args.latency_jitter,
+                             error_rate=args.error_rate)
+    print("Serving %s at %s" % (args.root, server.url), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.format_stats(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+import klupung.geocode
+import klupung.geocodecache
+import klupung.httppool
+
+import fake_ktweb
+import fake_geocoder
+
+_DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   "corpus")
+
+def _copy_tree(corpus_dir, tree_dir, copies):
+    # Each copy has the same agenda item texts, like meeting documents
+    # published both as agendas and as minutes.
+    for i in range(copies):
+        shutil.copytree(corpus_dir, os.path.join(tree_dir, "copy%d" % i))
+
+def _run(name, tree_dir, geocoder_url, max_workers, cache):
+    connection_pool = klupung.httppool.ConnectionPool(maxsize=max_workers)
+    stats = klupung.geocode.GeocodeStats()
+    failed_count = 0
+    start_time = time.time()
+    for filepath, error in klupung.geocode.geocode_agenda_items(
+        tree_dir, geocoder_url, max_workers=max_workers, cache=cache,
+        stats=stats, connection_pool=connection_pool):
+        if error is not None:
+            failed_count += 1
+    wall_time = time.time() - start_time
+    connection_pool.close()
+
+    print("%s: %s" % (name, stats.format_stats()))
+    print("  %.1f pages/s, %s" % (stats.page_count / wall_time if wall_time
+                                  else 0, connection_pool.format_stats()))
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark klupung.geocode.geocode_agenda_items() against "
+        "a local fake geocoder: one request at a time without a cache, like "
+        "the old curl loop, concurrently with an empty cache, and again over "
+        "a fresh copy of the tree with the cache filled by the previous run.")
+
+    fake_ktweb.add_server_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "--corpus",
+        metavar="DIR",
+        default=_DEFAULT_CORPUS_DIR,
+        help="KTweb directory tree to geocode, default=benchmarks/corpus")
+
+    arg_parser.add_argument(
+        "--copies",
+        type=int,
+        default=2,
+        help="number of copies of the tree geocoded at once, default=2")
+
+    arg_parser.add_argument(
+        "--max-requests-in-flight",
+        type=int,
+        default=4,
+        help="see klupung-geocode-ktweb, default=4")
+
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="klupung-geocode-")
+    try:
+        server = fake_geocoder.FakeGeocoderServer(
+            latency=args.latency, latency_jitter=args.latency_jitter,
+            error_rate=args.error_rate)
+        server.start()
+        try:
+            geocoder_url = server.url + "/Jyv%C3%A4skyl%C3%A4"
+
+            tree_dir = os.path.join(tmp_dir, "sequential")
+            _copy_tree(args.corpus, tree_dir, args.copies)
+            _run("sequential", tree_dir, geocoder_url, 1, None)
+
+            cache = klupung.geocodecache.GeocodeCache(
+                os.path.join(tmp_dir, "geocode_cache.db"))
+            try:
+                tree_dir = os.path.join(tmp_dir, "concurrent")
+                _copy_tree(args.corpus, tree_dir, args.copies)
+                _run("concurrent", tree_dir, geocoder_url,
+                     args.max_requests_in_flight, cache)
+
+                tree_dir = os.path.join(tmp_dir, "cached")
+                _copy_tree(args.corpus, tree_dir, args.copies)
+                _run("cached", tree_dir, geocoder_url,
+                     args.max_requests_in_flight, cache)
+            finally:
+                cache.close()
+        finally:
+            server.stop()
+        print("server: %s" % server.format_stats())
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import os
+import sys
+import time
+
+import klupung.ktweb
+
+_DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   "corpus")
+
+def parse_meeting_documents(dirpaths, parse_backend):
+    # Returns parse_meeting_document() results (or the exceptions
+    # raised) by dirpath and the time it took to parse them all.
+    klupung.ktweb.set_parse_backend(parse_backend)
+    results = {}
+    start_time = time.time()
+    for dirpath in dirpaths:
+        try:
+            results[dirpath] = klupung.ktweb.parse_meeting_document(dirpath)
+        except Exception as e:
+            results[dirpath] = repr(e)
+    return results, time.time() - start_time
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Parse all meeting documents in DIR with each parse "
+        "backend, check that parse_meeting_document() returns identical "
+        "results with all of them and report the time per meeting "
+        "document. Exits with status 1 if any results differ.")
+
+    arg_parser.add_argument(
+        "ktweb_dir",
+        metavar="DIR",
+        nargs="?",
+        default=_DEFAULT_CORPUS_DIR,
+        help="KTWeb root directory, default: the sample corpus in "
+        "benchmarks/corpus")
+
+    arg_parser.add_argument(
+        "--backend",
+        metavar="NAME",
+        action="append",
+        choices=klupung.ktweb.PARSE_BACKEND_NAMES,
+        help="parse backend to compare against the first one, can be "
+        "given multiple times, default: all of %s" %
+        ", ".join(klupung.ktweb.PARSE_BACKEND_NAMES))
+
+    arg_parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=3,
+        help="parse the whole tree N times with each backend and take the "
+        "fastest, default: %(default)s")
+
+    args = arg_parser.parse_args()
+
+    backend_names = args.backend or klupung.ktweb.PARSE_BACKEND_NAMES
+    dirpaths = sorted(
+        klupung.ktweb.iter_meeting_document_dirpaths(args.ktweb_dir))
+    if not dirpaths:
+        print("error: no meeting documents found from %s" % args.ktweb_dir,
+              file=sys.stderr)
+        return 1
+
+    times = {}
+    mismatches = []
+    expected = None
+    for name in backend_names:
+        parse_backend = klupung.ktweb.make_parse_backend(name)
+        for _ in range(args.repeat):
+            results, elapsed_time = parse_meeting_documents(dirpaths,
+                                                            parse_backend)
+            if name not in times or elapsed_time < times[name]:
+                times[name] = elapsed_time
+        if expected is None:
+            expected = results
+            continue
+        for dirpath in dirpaths:
+            if results[dirpath] != expected[dirpath]:
+                mismatches.append((name, dirpath))
+
+    print("%d meeting documents" % len(dirpaths))
+    print("%-12s %12s %8s" % ("backend", "ms/document", "speedup"))
+    reference_time = times[backend_names[0]]
+    for name in backend_names:
+        print("%-12s %12.3f %7.2fx" % (
+                name,
+                1000 * times[name] / len(dirpaths),
+                reference_time / times[name]))
+
+    for name, dirpath in mismatches:
+        print("error: %s results differ from %s results: %s" %
+              (name, backend_names[0], dirpath), file=sys.stderr)
+
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import argparse
+import datetime
+import json
+import os
+import os.path
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import urlparse
+
+import klupung.ktweb
+
+import fake_ktweb
+
+_DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   "corpus")
+
+# Origin URLs of recorded meeting documents are rewritten to this base
+# URL, so that they do not depend on the port of the server they were
+# downloaded from.
+_RECORDED_BASE_URL = "http://ktweb.invalid/"
+
+_RESULTS_FORMAT_VERSION = 1
+
+def record_corpus(download_dir, policymakers, years, meetings_per_year,
+                  agenda_items_per_meeting, seed):
+    # Generates a synthetic KTweb tree and downloads it from a local
+    # fake KTweb server to download_dir, as klupung-download-ktweb
+    # would.
+    tmp_dir = tempfile.mkdtemp(prefix="klupung-parsers-")
+    try:
+        tree_dir = os.path.join(tmp_dir, "tree")
+        listing_relpaths = fake_ktweb.generate_tree(
+            tree_dir, policymakers=policymakers, years=years,
+            meetings_per_year=meetings_per_year,
+            agenda_items_per_meeting=agenda_items_per_meeting, seed=seed)
+        server = fake_ktweb.FakeKTwebServer(tree_dir)
+        server.start()
+        try:
+            policymaker_urls = [urlparse.urljoin(server.url, relpath)
+                                for relpath in listing_relpaths]
+            for _ in klupung.ktweb.download_policymakers(
+                policymaker_urls, min_interval=0, max_workers=4,
+                download_dir=download_dir):
+                pass
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for dirpath in klupung.ktweb.iter_meeting_document_dirpaths(download_dir):
+        origin_url_filepath = os.path.join(dirpath, "origin_url")
+        with open(origin_url_filepath) as f:
+            origin_url = f.read()
+        with open(origin_url_filepath, "w") as f:
+            f.write(origin_url.replace(server.url, _RECORDED_BASE_URL))
+
+class _MemoryMeetingDocument(object):
+    # Meeting document files read to memory beforehand, so that reading
+    # files does not count as parsing.
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        with klupung.ktweb.open_meeting_document(dirpath) as meeting_document:
+            self._files = dict((filename, meeting_document.read(filename))
+                               for filename in meeting_document.namelist())
+
+    def namelist(self):
+        return sorted(self._files)
+
+    def read(self, filename):
+        return self._files[filename]
+
+def _agenda_item_filenames(meeting_document):
+    return [filename for filename in meeting_document.namelist()
+            if filename.startswith("htmtxt") and filename.endswith(".htm")
+            and filename != "htmtxt0.htm"]
+
+def _meeting_document_type_work(meeting_documents):
+    return [((klupung.ktweb._parse_meeting_document_type, meeting_document),
+             len(meeting_document.read("index.htm")))
+            for meeting_document in meeting_documents]
+
+def _cover_page_work(meeting_documents):
+    return [((klupung.ktweb._parse_cover_page, meeting_document),
+             len(meeting_document.read("htmtxt0.htm")))
+            for meeting_document in meeting_documents]
+
+def _agenda_item_work(meeting_documents):
+    return [((klupung.ktweb._parse_agenda_item, meeting_document, filename),
+             len(meeting_document.read(filename)))
+            for meeting_document in meeting_documents
+            for filename in _agenda_item_filenames(meeting_document)]
+
+def _meeting_document_work(meeting_documents):
+    return [((klupung.ktweb._parse_meeting_document, meeting_document),
+             sum(len(meeting_document.read(filename))
+                 for filename in meeting_document.namelist()
+                 if filename.endswith(".htm")))
+            for meeting_document in meeting_documents]
+
+# Extractors by name, each with a function returning a list of
+# ((function, args...), byte_count) work items of a list of meeting
+# documents.
+EXTRACTORS = (
+    ("meeting_document_type", _meeting_document_type_work),
+    ("cover_page", _cover_page_work),
+    ("agenda_item", _agenda_item_work),
+    ("meeting_document", _meeting_document_work),
+    )
+
+def _measure(work, repeat, min_time):
+    # Returns the fastest time of running all work items once and the
+    # growth of the peak resident set size in kilobytes while running
+    # them. Each repetition runs the work items over and over for at
+    # least min_time seconds, so that small corpora are measured
+    # accurately. Python 2 cannot trace allocations, the peak RSS
+    # growth is the closest measure of how much memory the extractor
+    # allocates at once.
+    start_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best_time = None
+    for _ in range(repeat):
+        round_count = 0
+        start_time = time.time()
+        while True:
+            for (func_and_args, _) in work:
+                func_and_args[0](*func_and_args[1:])
+            round_count += 1
+            elapsed_time = time.time() - start_time
+            if elapsed_time >= min_time:
+                break
+        round_time = elapsed_time / round_count
+        if best_time is None or round_time < best_time:
+            best_time = round_time
+    end_maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return best_time, end_maxrss - start_maxrss
+
+def _measure_in_child(work, repeat, min_time):
+    # Measures in a forked child so that the peak RSS of each extractor
+    # is measured from the same baseline.
+    if not hasattr(os, "fork"):
+        return _measure(work, repeat, min_time)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            os.close(read_fd)
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(_measure(work, repeat, min_time), f)
+        except:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stderr.flush()
+            os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError("measuring process failed, see its traceback "
+                           "above")
+    return json.loads(data)
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(corpus_dir, parser, repeat, min_time):
+    """Return benchmark results of the corpus as a JSON-serializable dict."""
+    klupung.ktweb.set_parse_backend(klupung.ktweb.make_parse_backend(parser))
+    meeting_documents = [
+        _MemoryMeetingDocument(dirpath) for dirpath in
+        sorted(klupung.ktweb.iter_meeting_document_dirpaths(corpus_dir))]
+
+    extractors = {}
+    for name, make_work in EXTRACTORS:
+        work = make_work(meeting_documents)
+        seconds, peak_rss_kb = _measure_in_child(work, repeat,
+                                                min_time)
+        byte_count = sum(byte_count for (_, byte_count) in work)
+        extractors[name] = {
+            "count": len(work),
+            "bytes": byte_count,
+            "seconds": seconds,
+            "per_second": len(work) / seconds if seconds else None,
+            "mb_per_second": (byte_count / 1024 / 1024 / seconds
+                              if seconds else None),
+            "peak_rss_kb": peak_rss_kb,
+            }
+
+    return {
+        "format_version": _RESULTS_FORMAT_VERSION,
+        "time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parser": parser,
+        "corpus": os.path.abspath(corpus_dir),
+        "meeting_documents": len(meeting_documents),
+        "repeat": repeat,
+        "min_time": min_time,
+        "extractors": extractors,
+        }
+
+def _is_same_corpus(results, other_results):
+    # Corpora are compared by what was measured of them rather than by
+    # path, so that results of other checkouts and of synthetic corpora
+    # generated with the same options are comparable.
+    for name, _ in EXTRACTORS:
+        stats = results["extractors"][name]
+        other_stats = other_results["extractors"].get(name)
+        if (other_stats is None or stats["count"] != other_stats["count"]
+            or stats["bytes"] != other_stats["bytes"]):
+            return False
+    return True
+
+def _find_baseline(filepath, results):
+    # Returns the latest results in the JSON lines file which were
+    # measured from the same corpus with the same parser, or None.
+    baseline = None
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            candidate = json.loads(line)
+            if (candidate.get("format_version") == _RESULTS_FORMAT_VERSION
+                and candidate["parser"] == results["parser"]
+                and _is_same_corpus(results, candidate)):
+                baseline = candidate
+    return baseline
+
+def _print_results(results, baseline):
+    print("%d meeting documents in %s, parser: %s" %
+          (results["meeting_documents"], results["corpus"], results["parser"]))
+    header = "%-22s %7s %10s %8s %8s %12s" % (
+        "extractor", "count", "items/s", "MB/s", "ms/item", "peak RSS kB")
+    if baseline is not None:
+        header += " %10s" % "vs. base"
+    print(header)
+    for name, _ in EXTRACTORS:
+        stats = results["extractors"][name]
+        line = "%-22s %7d %10.1f %8.2f %8.3f %12d" % (
+            name, stats["count"], stats["per_second"], stats["mb_per_second"],
+            1000 * stats["seconds"] / stats["count"], stats["peak_rss_kb"])
+        if baseline is not None:
+            line += " %9.2fx" % _slowdown(results, baseline, name)
+        print(line)
+
+def _slowdown(results, baseline, name):
+    # Ratio of time per item to the baseline, > 1 is slower.
+    stats = results["extractors"][name]
+    base_stats = baseline["extractors"][name]
+    return ((stats["seconds"] / stats["count"]) /
+            (base_stats["seconds"] / base_stats["count"]))
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Measure the throughput and memory use of the KTweb "
+        "page extractors (meeting document type, cover page, agenda item "
+        "and whole meeting documents) over a recorded KTweb corpus, by "
+        "default the sample in benchmarks/corpus, or over a synthetic "
+        "corpus generated for scale, and compare the results to earlier "
+        "ones.")
+
+    arg_parser.add_argument(
+        "--corpus",
+        metavar="DIR",
+        default=_DEFAULT_CORPUS_DIR,
+        help="KTweb directory tree as downloaded with klupung-download-ktweb "
+        "(directories or packs), default: %(default)s")
+
+    arg_parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        default=False,
+        help="measure a synthetic corpus generated with the tree options "
+        "below instead of --corpus")
+
+    arg_parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="only record a synthetic corpus generated with the tree options "
+        "below to DIR, the sample corpus was recorded with: --record "
+        "benchmarks/corpus --policymakers kh,kv,sivltk --years 2012,2013 "
+        "--meetings-per-year 1 --agenda-items-per-meeting 8")
+
+    fake_ktweb.add_tree_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "--parser",
+        choices=klupung.ktweb.PARSE_BACKEND_NAMES,
+        default="default",
+        help="parse backend, default=default")
+
+    arg_parser.add_argument(
+        "--repeat",
+        metavar="N",
+        type=int,
+        default=5,
+        help="measure each extractor N times and take the fastest, "
+        "default: %(default)s")
+
+    arg_parser.add_argument(
+        "--min-time",
+        metavar="SECONDS",
+        type=float,
+        default=0.2,
+        help="run each extractor over the corpus repeatedly for at least "
+        "SECONDS per measurement, default: %(default)s")
+
+    arg_parser.add_argument(
+        "--output",
+        metavar="RESULTS_FILE",
+        help="append the results as a JSON line to RESULTS_FILE")
+
+    arg_parser.add_argument(
+        "--compare",
+        metavar="RESULTS_FILE",
+        help="compare to the latest results in RESULTS_FILE measured from "
+        "the same corpus with the same parser, and exit with status 1 if "
+        "any extractor is slower than --max-slowdown allows")
+
+    arg_parser.add_argument(
+        "--max-slowdown",
+        metavar="RATIO",
+        type=float,
+        default=1.3,
+        help="maximum allowed ratio of time per item to the compared "
+        "results, default: %(default)s")
+
+    args = arg_parser.parse_args()
+
+    tree_kwargs = {
+        "policymakers": args.policymakers.split(","),
+        "years": [int(year) for year in args.years.split(",")],
+        "meetings_per_year": args.meetings_per_year,
+        "agenda_items_per_meeting": args.agenda_items_per_meeting,
+        "seed": args.seed,
+        }
+
+    if args.record:
+        record_corpus(args.record, **tree_kwargs)
+        return 0
+
+    tmp_dir = None
+    try:
+        if args.synthetic:
+            tmp_dir = tempfile.mkdtemp(prefix="klupung-parsers-")
+            corpus_dir = os.path.join(tmp_dir, "corpus")
+            record_corpus(corpus_dir, **tree_kwargs)
+        else:
+            corpus_dir = args.corpus
+        results = run(corpus_dir, args.parser, args.repeat, args.min_time)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    if not results["meeting_documents"]:
+        print("error: no meeting documents found from %s" % corpus_dir,
+              file=sys.stderr)
+        return 1
+
+    baseline = None
+    if args.compare:
+        baseline = _find_baseline(args.compare, results)
+        if baseline is None:
+            print("warning: no comparable results in %s" % args.compare,
+                  file=sys.stderr)
+
+    _print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "a") as f:
+            print(json.dumps(results, sort_keys=True), file=f)
+
+    if baseline is not None:
+        slow_names = [name for name, _ in EXTRACTORS
+                      if _slowdown(results, baseline, name) > args.max_slowdown]
+        for name in slow_names:
+            print("error: %s is %.2fx slower than in %s (revision %s)" %
+                  (name, _slowdown(results, baseline, name), args.compare,
+                   baseline["revision"]), file=sys.stderr)
+        if slow_names:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -33,27 +33,29 @@ def read_soup(filepath, encoding="utf-8"):
     with open(filepath, encoding=encoding, errors="replace") as f:
         return bs4.BeautifulSoup(f, from_encoding=encoding)
 
-def clean_soup(soup):
-
-    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Comment)):
-        tag.extract()
-
-    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Declaration)):
-        tag.extract()
-
-    for tag in soup("style"):
-        tag.extract()
+SAVED_ATTRS = frozenset(["class", "href", "target"])
+REMOVED_TAG_NAMES = frozenset(["style", "meta"])
+REMOVED_STRING_TYPES = (bs4.Comment, bs4.Declaration)
 
-    for tag in soup("meta"):
-        tag.extract()
-
-    for tag in soup.find_all():
-        attrs = tag.attrs
-        saved_attrs = set(["class", "href", "target"]) & set(attrs.keys())
-        tag.attrs = {a: attrs[a] for a in saved_attrs}
-
-    for tag in soup.find_all(text=True):
-        tag.replace_with(re.sub(r"\r", "", tag.string))
+def clean_soup(soup):
+    # Remove comments, declarations, style and meta elements,
+    # attributes other than SAVED_ATTRS and carriage returns in a
+    # single walk over the tree.
+    tags = [soup]
+    while tags:
+        tag = tags.pop()
+        for child in list(tag.contents):
+            if isinstance(child, bs4.Tag):
+                if child.name in REMOVED_TAG_NAMES:
+                    child.extract()
+                    continue
+                attrs = child.attrs
+                child.attrs = {a: attrs[a] for a in SAVED_ATTRS.intersection(attrs)}
+                tags.append(child)
+            elif isinstance(child, REMOVED_STRING_TYPES):
+                child.extract()
+            elif type(child) is not bs4.NavigableString or "\r" in child:
+                child.replace_with(child.replace("\r", ""))
 
     return soup
 
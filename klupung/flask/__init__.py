@@ -14,18 +14,69 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+
 import flask
 import flask.ext.sqlalchemy
 import flask.ext.autodoc
+import sqlalchemy.engine.url
 
 db = flask.ext.sqlalchemy.SQLAlchemy()
 
+def _get_sqlite_filepath(db_uri):
+    url = sqlalchemy.engine.url.make_url(db_uri)
+    if url.drivername.split("+")[0] != "sqlite":
+        return None
+    if url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+def _reopen_db_when_replaced(app, db_filepath):
+    # The database file can be replaced by renaming a new one over it
+    # while the app is running, see deployment/jkl/run. Connections to
+    # the old file would keep reading it, so they are closed before the
+    # first request after the file has been replaced.
+    file_ids = []
+
+    @app.before_request
+    def check_db_file():
+        try:
+            st = os.stat(db_filepath)
+        except OSError:
+            return
+        file_id = (st.st_dev, st.st_ino)
+        if file_ids and file_ids[0] != file_id:
+            db.get_engine(app).dispose()
+        file_ids[:] = [file_id]
+
+def get_db_version(app):
+    """Return a value which changes whenever the database changes.
+
+    Only SQLite database files are supported: the value changes when
+    the file is written to or replaced. For other databases it is
+    always None.
+
+    """
+    db_filepath = app.config.get("KLUPUNG_DB_FILEPATH")
+    if db_filepath is None:
+        return None
+    try:
+        st = os.stat(db_filepath)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
 def create_app(db_uri):
     app = flask.Flask(__name__)
     app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
 
     db.init_app(app)
 
+    db_filepath = _get_sqlite_filepath(db_uri)
+    app.config['KLUPUNG_DB_FILEPATH'] = db_filepath
+    if db_filepath is not None:
+        _reopen_db_when_replaced(app, db_filepath)
+
     import klupung.flask.api
     klupung.flask.api.auto.init_app(app)
 
@@ -15,6 +15,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 ## Standard library imports
+import collections
 import datetime
 import re
 import urllib
@@ -24,6 +25,7 @@ import flask
 import flask.ext.autodoc
 
 ## Local imports
+import klupung.flask
 import klupung.flask.models
 
 class Error(Exception):
@@ -244,6 +246,66 @@ def _get_category_resource(category):
                                       category_id=category.id),
         }
 
+_CategoryNode = collections.namedtuple(
+    "_CategoryNode", ["id", "name", "origin_id", "parent_id", "top_category_id"])
+
+class _CategoryTree(object):
+    """Read-only tree of all categories.
+
+    Categories change only when they are imported, so each process
+    keeps them all in memory and serializes the category fields of
+    issues without querying the database, see `_get_category_tree()`.
+
+    """
+
+    def __init__(self, db_version):
+        self.db_version = db_version
+        category = klupung.flask.models.Category
+        self._nodes = {}
+        for row in klupung.flask.db.session.query(
+            category.id, category.name, category.origin_id,
+            category.parent_id, category.top_category_id):
+            self._nodes[row.id] = _CategoryNode(*row)
+
+    def get(self, category_id):
+        return self._nodes[category_id]
+
+    def get_top_category(self, category_id):
+        node = self._nodes[category_id]
+        if node.top_category_id is not None:
+            return self._nodes[node.top_category_id]
+        # The hierarchy has not been materialized yet, the categories
+        # have not been imported since the columns were added.
+        while node.parent_id is not None:
+            node = self._nodes[node.parent_id]
+        return node
+
+# Category tree of this process, replaced when the database changes.
+_category_tree = None
+
+def _get_category_tree():
+    """Return the category tree, reload it if the database has changed
+
+    The database is checked once per request, and only if it is an
+    SQLite file, see `klupung.flask.get_db_version()`. Otherwise the
+    tree is loaded once.
+
+    """
+
+    global _category_tree
+
+    tree = getattr(flask.g, "klupung_category_tree", None)
+    if tree is not None:
+        return tree
+
+    db_version = klupung.flask.get_db_version(flask.current_app)
+    tree = _category_tree
+    if tree is None or tree.db_version != db_version:
+        tree = _CategoryTree(db_version)
+        _category_tree = tree
+    flask.g.klupung_category_tree = tree
+    return tree
+
 def _get_issue_resource(issue):
     geometries = []
     for agenda_item in issue.agenda_items:
@@ -254,11 +316,13 @@ def _get_issue_resource(issue):
                     "category": geometry.category,
                     "coordinates": geometry.coordinates,
                     })
+    category_tree = _get_category_tree()
+    category = category_tree.get(issue.category_id)
     return {
         "category"            : flask.url_for("._category_id_route",
                                               category_id=issue.category_id),
-        "category_name"       : issue.category.name,
-        "category_origin_id"  : issue.category.origin_id,
+        "category_name"       : category.name,
+        "category_origin_id"  : category.origin_id,
         "districts"           : [],
         "geometries"          : geometries,
         "id"                  : issue.id,
@@ -269,7 +333,7 @@ def _get_issue_resource(issue):
         "slug"                : issue.slug,
         "subject"             : issue.subject,
         "summary"             : issue.summary,
-        "top_category_name"   : issue.category.find_top_category().name,
+        "top_category_name"   : category_tree.get_top_category(issue.category_id).name,
         "resource_uri"        : flask.url_for("._issue_id_route",
                                               issue_id=issue.id),
         }
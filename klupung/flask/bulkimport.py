@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+from urlparse import urljoin
+
+import sqlalchemy
+
+import klupung.flask
+import klupung.flask.models
+
+# SQLite allows at most 999 parameters per statement.
+_MAX_IN_VALUES = 500
+
+class _Rows(object):
+    # Rows of a table touched by a batch, by key. Existing rows are
+    # selected by the values of a single column, new rows are inserted,
+    # changed rows updated and deleted rows deleted with one executemany
+    # each. Like the ORM, only rows whose values actually change are
+    # updated.
+
+    def __init__(self, table, key_columns, select_column):
+        self._table = table
+        self._key_columns = key_columns
+        self._select_column = select_column
+        self._rows = {}
+        self._new_keys = []
+        self._changed_keys = set()
+        self._deleted_ids = []
+
+    def _key(self, values):
+        return tuple(values[column] for column in self._key_columns)
+
+    def _select(self, connection, values):
+        column = self._table.c[self._select_column]
+        values = sorted(set(values))
+        for i in range(0, len(values), _MAX_IN_VALUES):
+            result = connection.execute(self._table.select().where(
+                    column.in_(values[i:i + _MAX_IN_VALUES])))
+            for row in result:
+                yield dict(row)
+
+    def select(self, connection, values):
+        """Select existing rows whose select column has one of `values`."""
+        for row in self._select(connection, values):
+            self._rows[self._key(row)] = row
+
+    def select_all(self, connection):
+        for row in connection.execute(self._table.select()):
+            row = dict(row)
+            self._rows[self._key(row)] = row
+
+    def get(self, *key):
+        return self._rows.get(key)
+
+    def insert(self, values):
+        key = self._key(values)
+        row = dict(values, id=None)
+        self._rows[key] = row
+        self._new_keys.append(key)
+        return row
+
+    def update(self, row, values):
+        for column, value in values.items():
+            if row[column] != value:
+                row[column] = value
+                if row["id"] is not None:
+                    self._changed_keys.add(self._key(row))
+
+    def delete(self, row):
+        # Only existing rows can be deleted.
+        key = self._key(row)
+        del self._rows[key]
+        self._changed_keys.discard(key)
+        self._deleted_ids.append(row["id"])
+
+    def write(self, connection):
+        """Write new, changed and deleted rows and select the ids of the new ones."""
+        if self._deleted_ids:
+            connection.execute(
+                self._table.delete().where(
+                    self._table.c.id == sqlalchemy.bindparam("_id")),
+                [{"_id": id} for id in self._deleted_ids])
+            self._deleted_ids = []
+
+        if self._new_keys:
+            new_rows = [self._rows[key] for key in self._new_keys]
+            connection.execute(
+                self._table.insert(),
+                [dict((column, value) for column, value in row.items()
+                      if column != "id") for row in new_rows])
+            # Selecting the new rows selects also existing rows with the
+            # same values in the select column, their changes must not
+            # be lost.
+            new_keys = set(self._new_keys)
+            for row in self._select(connection, [row[self._select_column]
+                                                 for row in new_rows]):
+                key = self._key(row)
+                if key in new_keys:
+                    self._rows[key]["id"] = row["id"]
+            self._new_keys = []
+
+        if self._changed_keys:
+            changed_rows = [self._rows[key] for key in self._changed_keys]
+            connection.execute(
+                self._table.update().where(
+                    self._table.c.id == sqlalchemy.bindparam("_id")),
+                [dict([(column, value) for column, value in row.items()
+                       if column not in ("id", "last_modified_time")],
+                      _id=row["id"]) for row in changed_rows])
+            self._changed_keys = set()
+
+class BulkImporter(object):
+    """Imports parsed KTweb minutes to the database in batches.
+
+    Meeting documents given to add(), as parsed by
+    klupung.ktweb.parse_meeting_document(), are written when
+    `batch_size` of them have been added, and the rest by flush().
+    Policymakers, categories, meetings and issues are selected once and
+    kept in memory. For each batch, the other rows it touches are
+    selected with a few queries per table, all of them are changed in
+    memory in the order the documents were added, and written with one
+    executemany INSERT and UPDATE per table. The batch is committed at
+    once. The database ends up the same as when importing the documents
+    one by one with the ORM.
+
+    Meetings and issues kept in memory grow with the database. If
+    `keep_rows` is false, they are selected by each batch like the
+    other rows and forgotten after it instead, so that memory use stays
+    flat no matter how large the database is, at the cost of a few more
+    queries per batch.
+
+    """
+
+    def __init__(self, session, batch_size=100, keep_rows=True):
+        self._session = session
+        self.batch_size = batch_size
+        self.keep_rows = keep_rows
+        self._batch = []
+        self._reset_identities()
+
+    def _reset_identities(self):
+        # Policymaker ids by abbreviation, category ids by origin id,
+        # meetings by (policymaker id, date) and issues by register id
+        # are selected once, by the first batch, and kept up to date as
+        # batches write them. Batches do not select them again. They
+        # are selected again after a failed batch, and after each batch
+        # unless rows are kept.
+        self._policymaker_ids = None
+        self._category_ids = None
+        self._meetings = None
+        self._issues = None
+
+    def _load_identities(self, connection, batch):
+        models = klupung.flask.models
+
+        policymaker_table = models.Policymaker.__table__
+        self._policymaker_ids = dict(
+            (abbreviation, id) for id, abbreviation in connection.execute(
+                sqlalchemy.select([policymaker_table.c.id,
+                                   policymaker_table.c.abbreviation])))
+
+        category_table = models.Category.__table__
+        self._category_ids = dict(
+            (origin_id, id) for id, origin_id in connection.execute(
+                sqlalchemy.select([category_table.c.id,
+                                   category_table.c.origin_id])))
+
+        self._meetings = _Rows(models.Meeting.__table__,
+                               ("policymaker_id", "date"), "date")
+        self._issues = _Rows(models.Issue.__table__, ("register_id",),
+                             "register_id")
+        if self.keep_rows:
+            self._meetings.select_all(connection)
+            self._issues.select_all(connection)
+        else:
+            self._meetings.select(connection, [data["start_datetime"]
+                                               for data in batch])
+            self._issues.select(connection, [
+                    agenda_item_data["dnro"] for data in batch
+                    for agenda_item_data in data["agenda_items"]
+                    if agenda_item_data["dnro"] is not None])
+
+    def add(self, meeting_document_data):
+        self._batch.append(meeting_document_data)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        batch = self._batch
+        self._batch = []
+        if not batch:
+            return
+        try:
+            connection = self._session.connection()
+            if self._issues is None:
+                self._load_identities(connection, batch)
+            self._write(connection, batch)
+        except:
+            self._session.rollback()
+            self._reset_identities()
+            raise
+        self._session.commit()
+        if not self.keep_rows:
+            self._reset_identities()
+
+    def _write(self, connection, batch):
+        models = klupung.flask.models
+
+        meetings = self._meetings
+        meeting_keys = []
+        for data in batch:
+            key = (self._policymaker_ids.get(data["policymaker_abbreviation"]),
+                   data["start_datetime"])
+            if meetings.get(*key) is None:
+                meetings.insert({"policymaker_id": key[0], "date": key[1]})
+            meeting_keys.append(key)
+        meetings.write(connection)
+
+        meeting_documents = _Rows(models.MeetingDocument.__table__,
+                                  ("origin_id",), "origin_id")
+        meeting_documents.select(connection,
+                                 [data["origin_id"] for data in batch])
+        revised = []
+        for data, meeting_key in zip(batch, meeting_keys):
+            meeting_document = meeting_documents.get(data["origin_id"])
+            revised.append(meeting_document is not None)
+            if meeting_document is None:
+                meeting_documents.insert({
+                        "meeting_id": meetings.get(*meeting_key)["id"],
+                        "origin_url": data["origin_url"],
+                        "origin_id": data["origin_id"],
+                        "publish_datetime": data["publish_datetime"],
+                        "fingerprint": data["fingerprint"],
+                        "stat_key": data["stat_key"],
+                        })
+            else:
+                # The document has been revised since it was imported.
+                meeting_documents.update(meeting_document, {
+                        "meeting_id": meetings.get(*meeting_key)["id"],
+                        "origin_url": data["origin_url"],
+                        "publish_datetime": data["publish_datetime"],
+                        "fingerprint": data["fingerprint"],
+                        "stat_key": data["stat_key"],
+                        })
+        meeting_documents.write(connection)
+
+        self._write_agenda_items(connection, batch,
+                                 [meetings.get(*key) for key in meeting_keys],
+                                 revised)
+
+    def _write_agenda_items(self, connection, batch, meetings, revised):
+        # Issues are written first, agenda items refer to them.
+        models = klupung.flask.models
+
+        default_category_id = self._category_ids.get("00")
+
+        issues = self._issues
+        for data, meeting, is_revised in zip(batch, meetings, revised):
+            dnros = set()
+            for agenda_item_data in data["agenda_items"]:
+                dnro = agenda_item_data["dnro"]
+                if dnro is None:
+                    continue
+                issue = issues.get(dnro)
+                subject = agenda_item_data["subject"]
+                # Issues are updated from their latest decisions. A
+                # revised document updates also issues it was the latest
+                # decision of, from the first agenda item of each issue
+                # like when it was imported.
+                is_latest_decision = (
+                    issue is not None
+                    and (meeting["date"] > issue["latest_decision_date"]
+                         or (is_revised and dnro not in dnros
+                             and meeting["date"] == issue["latest_decision_date"])))
+                dnros.add(dnro)
+                if issue is None:
+                    issues.insert({
+                            "register_id": dnro,
+                            "subject": subject,
+                            "summary": subject,
+                            "category_id": default_category_id,
+                            "latest_decision_date": meeting["date"],
+                            "slug": models._slugify(dnro),
+                            })
+                elif is_latest_decision:
+                    issues.update(issue, {
+                            "subject": subject,
+                            "summary": subject,
+                            "latest_decision_date": meeting["date"],
+                            })
+        issues.write(connection)
+
+        agenda_items = _Rows(models.AgendaItem.__table__,
+                             ("meeting_id", "index"), "meeting_id")
+        agenda_items.select(connection, [meeting["id"] for meeting in meetings])
+        agenda_item_keys = []
+        replaced_issue_ids = set()
+        for data, meeting in zip(batch, meetings):
+            for agenda_item_data in data["agenda_items"]:
+                index = agenda_item_data["number"]
+                key = (meeting["id"], index)
+                agenda_item = agenda_items.get(*key)
+                values = {
+                    "subject": agenda_item_data["subject"],
+                    "introducer": ", ".join(agenda_item_data["introducers"]),
+                    "preparer": ", ".join(agenda_item_data["preparers"]),
+                    "permalink": urljoin(data["origin_url"],
+                                         "htmtxt%d.htm" % index),
+                    "origin_last_modified_time": data["publish_datetime"],
+                    }
+                issue_id = None
+                if agenda_item_data["dnro"] is not None:
+                    issue_id = issues.get(agenda_item_data["dnro"])["id"]
+                values["issue_id"] = issue_id
+                if agenda_item is None:
+                    values.update({
+                            "meeting_id": meeting["id"],
+                            "index": index,
+                            "resolution": models.AgendaItem.RESOLUTION_PASSED,
+                            })
+                    agenda_items.insert(values)
+                else:
+                    if agenda_item["issue_id"] not in (None, issue_id):
+                        replaced_issue_ids.add(agenda_item["issue_id"])
+                    agenda_items.update(agenda_item, values)
+                agenda_item_keys.append(key)
+        agenda_items.write(connection)
+
+        if replaced_issue_ids:
+            self._delete_orphan_issues(connection, replaced_issue_ids)
+
+        contents = _Rows(models.Content.__table__,
+                         ("agenda_item_id", "index"), "agenda_item_id")
+        agenda_item_ids = [agenda_items.get(*key)["id"]
+                           for key in agenda_item_keys]
+        contents.select(connection, agenda_item_ids)
+        agenda_items_data = [agenda_item_data for data in batch
+                             for agenda_item_data in data["agenda_items"]]
+        for agenda_item_id, agenda_item_data in zip(agenda_item_ids,
+                                                    agenda_items_data):
+            for content_type, index, text in (
+                (models.Content.CONTENT_TYPE_RESOLUTION,
+                 models.Content.CONTENT_INDEX_RESOLUTION,
+                 agenda_item_data["resolution"]),
+                (models.Content.CONTENT_TYPE_DRAFT_RESOLUTION,
+                 models.Content.CONTENT_INDEX_DRAFT_RESOLUTION,
+                 agenda_item_data["proposal"])):
+                content = contents.get(agenda_item_id, index)
+                if content is None:
+                    if text is not None:
+                        contents.insert({
+                                "content_type": content_type,
+                                "text": text,
+                                "index": index,
+                                "agenda_item_id": agenda_item_id,
+                                })
+                elif text is None:
+                    # Removed from a revised document.
+                    contents.delete(content)
+                else:
+                    contents.update(content, {"text": text})
+        contents.write(connection)
+
+    def _delete_orphan_issues(self, connection, issue_ids):
+        # Deletes the issues no agenda item refers to any more, e.g.
+        # because the Dnro of an agenda item has been corrected.
+        issue_table = klupung.flask.models.Issue.__table__
+        agenda_item_table = klupung.flask.models.AgendaItem.__table__
+        issue_ids = sorted(issue_ids)
+        register_ids = []
+        for i in range(0, len(issue_ids), _MAX_IN_VALUES):
+            result = connection.execute(
+                sqlalchemy.select([issue_table.c.register_id]).where(
+                    issue_table.c.id.in_(issue_ids[i:i + _MAX_IN_VALUES])).where(
+                    ~sqlalchemy.exists().where(
+                        agenda_item_table.c.issue_id == issue_table.c.id)))
+            register_ids.extend(register_id for (register_id,) in result)
+        # Unless rows are kept, the batch has not selected the issues
+        # its agenda items no longer refer to.
+        self._issues.select(connection, [register_id for register_id
+                                         in register_ids
+                                         if self._issues.get(register_id)
+                                         is None])
+        for register_id in register_ids:
+            self._issues.delete(self._issues.get(register_id))
+        self._issues.write(connection)
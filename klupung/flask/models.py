@@ -114,6 +114,11 @@ class AgendaItem(klupung.flask.db.Model):
         "AgendaItemGeometry",
         backref="agenda_item",
         )
+    geometry_file = klupung.flask.db.relationship(
+        "AgendaItemGeometryFile",
+        uselist=False,
+        backref="agenda_item",
+        )
 
     __table_args__ = (
         klupung.flask.db.CheckConstraint(index >= 0, name="check_index_positive"),
@@ -158,6 +163,19 @@ class Category(klupung.flask.db.Model):
         nullable=True, # Top-level category does not have a parent
                        # category.
         )
+    # The hierarchy is materialized by update_hierarchy() when
+    # categories are imported: the top-level ancestor of the category
+    # (itself if it is a top-level category) and the ids of all of its
+    # ancestors from the top down and itself, separated by slashes.
+    top_category_id = klupung.flask.db.Column(
+        klupung.flask.db.Integer,
+        klupung.flask.db.ForeignKey("category.id"),
+        nullable=True,
+        )
+    path = klupung.flask.db.Column(
+        klupung.flask.db.Text,
+        nullable=True,
+        )
 
     # Relationships
     issues = klupung.flask.db.relationship(
@@ -168,6 +186,15 @@ class Category(klupung.flask.db.Model):
     parent = klupung.flask.db.relationship(
         "Category",
         uselist=False,
+        foreign_keys=[parent_id],
+        remote_side=[id],
+        )
+
+    top_category = klupung.flask.db.relationship(
+        "Category",
+        uselist=False,
+        foreign_keys=[top_category_id],
+        remote_side=[id],
         )
 
     __table_args__ = (
@@ -180,9 +207,27 @@ class Category(klupung.flask.db.Model):
         self.parent = parent
         self.level = 0
         if self.parent is not None:
-            self.level = klupung.flask.models.Category.query.filter_by(parent=parent).first().level + 1
+            self.level = self.parent.level + 1
+
+    def update_hierarchy(self):
+        """Update level, top category and path from the parent.
+
+        The category must have an id, and the hierarchy of its parent
+        must be up to date.
+
+        """
+        if self.parent is None:
+            self.level = 0
+            self.top_category_id = self.id
+            self.path = "%d" % self.id
+        else:
+            self.level = self.parent.level + 1
+            self.top_category_id = self.parent.top_category_id
+            self.path = "%s/%d" % (self.parent.path, self.id)
 
     def find_top_category(self):
+        if self.top_category is not None:
+            return self.top_category
         if self.parent:
             return self.parent.find_top_category()
         return self
@@ -312,16 +357,33 @@ class MeetingDocument(klupung.flask.db.Model):
     publish_datetime = klupung.flask.db.Column(
         klupung.flask.db.DateTime,
         )
+    # Fingerprint of the files the meeting document was imported from,
+    # see klupung.ktweb.fingerprint_meeting_document(). Documents
+    # imported before fingerprints were introduced do not have one.
+    fingerprint = klupung.flask.db.Column(
+        klupung.flask.db.String(40),
+        nullable=True,
+        )
+    # Key of the sizes and mtimes of the same files, compared before
+    # the fingerprint which may need the files to be read, see
+    # klupung.ktweb.get_meeting_document_keys().
+    stat_key = klupung.flask.db.Column(
+        klupung.flask.db.String(40),
+        nullable=True,
+        )
 
     __table_args__ = (
         klupung.flask.db.UniqueConstraint("origin_id"),
         )
 
-    def __init__(self, origin_url, meeting, origin_id, publish_datetime):
+    def __init__(self, origin_url, meeting, origin_id, publish_datetime,
+                 fingerprint=None, stat_key=None):
         self.origin_url = origin_url
         self.meeting = meeting
         self.origin_id = origin_id
         self.publish_datetime = publish_datetime
+        self.fingerprint = fingerprint
+        self.stat_key = stat_key
 
 class Policymaker(klupung.flask.db.Model):
     __tablename__ = "policymaker"
@@ -474,3 +536,30 @@ class AgendaItemGeometry(klupung.flask.db.Model):
         self.type = type
         self.name = name
         self.coordinates = coordinates
+
+class AgendaItemGeometryFile(klupung.flask.db.Model):
+    # Geometry file each agenda item's geometries were imported from,
+    # see bin/klupung-dbimport-ktweb-geometries. Geometries are imported
+    # again only when the file has changed.
+    __tablename__ = "agenda_item_geometry_file"
+
+    # Columns
+    agenda_item_id = klupung.flask.db.Column(
+        klupung.flask.db.Integer,
+        klupung.flask.db.ForeignKey("agenda_item.id"),
+        primary_key=True,
+        )
+    mtime = klupung.flask.db.Column(
+        klupung.flask.db.Float,
+        nullable=False,
+        )
+    # SHA-1 of the contents of the file.
+    hash = klupung.flask.db.Column(
+        klupung.flask.db.String(40),
+        nullable=False,
+        )
+
+    def __init__(self, agenda_item, mtime, hash):
+        self.agenda_item = agenda_item
+        self.mtime = mtime
+        self.hash = hash
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import hashlib
+import os
+import os.path
+import threading
+import time
+import traceback
+
+import klupung.httppool
+import klupung.ktweb
+import klupung.util
+
+# Agenda item pages are geocoded by posting them to a geocoder which
+# responds with a JSON list of the geometries (addresses, plans and plan
+# units) found in them. The response is stored next to the page, see
+# geocode_agenda_items() and bin/klupung-dbimport-ktweb-geometries.
+_GEOMETRIES_SUFFIX = ".geometries.json"
+
+class GeocodeStats(object):
+    # Counts of geocode_agenda_items(), updated from all of its worker
+    # threads.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self.page_count = 0
+        self.text_count = 0
+        self.cached_count = 0
+        self.geocoded_count = 0
+        self.failed_count = 0
+        self.byte_count = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def format_stats(self):
+        elapsed_time = time.time() - self._start_time
+        return ("%d pages, %d distinct texts: %d from cache, %d geocoded "
+                "(%.1f MB), %d failed, %.1f texts/s, %.1f s" % (
+                self.page_count, self.text_count, self.cached_count,
+                self.geocoded_count, self.byte_count / 1024 / 1024,
+                self.failed_count,
+                self.text_count / elapsed_time if elapsed_time else 0,
+                elapsed_time))
+
+def _iter_ungeocoded_agenda_item_filepaths(dirpath):
+    for dirpath, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        filenames = set(filenames)
+        for filename in klupung.ktweb.iter_agenda_item_filenames(filenames):
+            if filename + _GEOMETRIES_SUFFIX not in filenames:
+                yield os.path.join(dirpath, filename)
+
+def geocode_agenda_items(dirpath, geocoder_url, max_workers=1, cache=None,
+                         stats=None, connection_pool=None):
+    # Geocodes agenda item pages in dirpath which have not been geocoded
+    # yet, up to max_workers at a time over keep-alive connections, and
+    # yields (filepath, error) of each page in the order they complete.
+    # error is None or the formatted exception the page failed with.
+    #
+    # Meeting documents are often published more than once, e.g. as an
+    # agenda and as minutes, with the same agenda item texts. Each
+    # distinct text is posted once for all the pages it is in, and not
+    # at all if its response is found in the cache (see
+    # klupung.geocodecache).
+    if stats is None:
+        stats = GeocodeStats()
+    own_connection_pool = connection_pool is None
+    if own_connection_pool:
+        connection_pool = klupung.httppool.ConnectionPool(maxsize=max_workers)
+
+    # Each page is read once, the text of the first page with each key
+    # is kept until it has been geocoded.
+    filepaths_by_key = {}
+    bodies_by_key = {}
+    keys = []
+    for filepath in _iter_ungeocoded_agenda_item_filepaths(dirpath):
+        body = klupung.ktweb.read_page(filepath)
+        key = hashlib.sha1("%s\n%s" % (geocoder_url, body)).hexdigest()
+        try:
+            filepaths_by_key[key].append(filepath)
+        except KeyError:
+            filepaths_by_key[key] = [filepath]
+            bodies_by_key[key] = body
+            keys.append(key)
+        stats.add(page_count=1)
+
+    def geocode(key):
+        filepaths = filepaths_by_key[key]
+        body = bodies_by_key.pop(key)
+        try:
+            data = None
+            if cache is not None:
+                data = cache.get(key)
+            if data is None:
+                # Posted like curl --data-binary has always posted them.
+                data = connection_pool.urlopen(
+                    geocoder_url,
+                    {"Content-Type": "application/x-www-form-urlencoded"},
+                    body).data
+                stats.add(geocoded_count=1, byte_count=len(body))
+                if cache is not None:
+                    cache.update(key, data)
+            else:
+                stats.add(cached_count=1)
+            for filepath in filepaths:
+                klupung.util.write_to_file_atomically(
+                    filepath + _GEOMETRIES_SUFFIX, data)
+        except Exception:
+            stats.add(text_count=1, failed_count=1)
+            error = traceback.format_exc()
+            return [(filepath, error) for filepath in filepaths]
+        stats.add(text_count=1)
+        return [(filepath, None) for filepath in filepaths]
+
+    try:
+        for results in klupung.util.imap_unordered(geocode, keys,
+                                                   max_workers):
+            for result in results:
+                yield result
+    finally:
+        if own_connection_pool:
+            connection_pool.close()
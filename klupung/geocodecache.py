@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import sqlite3
+import threading
+
+class GeocodeCache(object):
+    """Persistent cache of geocoder responses.
+
+    Keeps the response of the geocoder to each request, by a key of the
+    request, see klupung.geocode.geocode_agenda_items(). Agenda item
+    texts which have already been geocoded, also as parts of other
+    meeting documents, are then not sent to the geocoder again.
+
+    The cache can be shared between threads.
+
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_result (
+                    request_key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                )""")
+
+    def get(self, request_key):
+        """Return the response data of `request_key` or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM geocode_result WHERE request_key = ?",
+                (request_key,)).fetchone()
+        if row is None:
+            return None
+        return str(row[0])
+
+    def update(self, request_key, data):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_result (request_key, data) "
+                "VALUES (?, ?)", (request_key, sqlite3.Binary(data)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
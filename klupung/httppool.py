@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import httplib
+import socket
+import threading
+
+from urllib2 import HTTPError
+from urlparse import urljoin, urlsplit
+
+_REDIRECT_STATUSES = set((301, 302, 303, 307))
+_MAX_REDIRECTS = 5
+
+class Response(object):
+    """Complete HTTP response read from a pooled connection."""
+
+    def __init__(self, url, status, reason, headers, data):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+class ConnectionPool(object):
+    """Pool of persistent (keep-alive) HTTP connections.
+
+    At most `maxsize` idle connections are kept per host. More
+    connections are opened if more requests are in flight
+    concurrently, but those are closed instead of returned to the pool
+    after use. `timeout` is the socket timeout in seconds for
+    connecting and reading.
+
+    The pool can be shared between threads.
+
+    """
+
+    def __init__(self, maxsize=1, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+        self.reuse_count = 0
+
+    def _get_connection(self, scheme, netloc):
+        with self._lock:
+            try:
+                return self._idle_connections[(scheme, netloc)].pop(), True
+            except (KeyError, IndexError):
+                self.connection_count += 1
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _put_connection(self, scheme, netloc, connection):
+        with self._lock:
+            idle_connections = self._idle_connections.setdefault(
+                (scheme, netloc), [])
+            if len(idle_connections) < self.maxsize:
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def _request(self, url, headers, data):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if query:
+            path = "%s?%s" % (path, query)
+        method = "GET" if data is None else "POST"
+
+        while True:
+            connection, is_reused = self._get_connection(scheme, netloc)
+            try:
+                connection.request(method, path or "/", body=data,
+                                   headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if is_reused:
+                    # The server has most probably closed the idle
+                    # connection meanwhile, try again with a fresh
+                    # one.
+                    continue
+                raise
+            except:
+                connection.close()
+                raise
+            break
+
+        with self._lock:
+            self.request_count += 1
+            if is_reused:
+                self.reuse_count += 1
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(scheme, netloc, connection)
+
+        return Response(url, response.status, response.reason,
+                        response.msg, data)
+
+    def urlopen(self, url, headers={}, data=None):
+        """Return Response of GET `url`, or POST `data` to it, follow redirects.
+
+        Like urllib2, redirects are followed with GET. Requests sent
+        over a reused connection which turns out to be closed are sent
+        again, so POST only requests which can be repeated.
+
+        Raises urllib2.HTTPError if the final response status is 400 or
+        greater.
+
+        """
+
+        for _ in range(_MAX_REDIRECTS + 1):
+            response = self._request(url, headers, data)
+            if response.status not in _REDIRECT_STATUSES:
+                break
+            url = urljoin(url, response.headers.getheader("Location"))
+            data = None
+
+        if response.status >= 400:
+            raise HTTPError(response.url, response.status, response.reason,
+                            response.headers, None)
+
+        return response
+
+    def close(self):
+        with self._lock:
+            for idle_connections in self._idle_connections.values():
+                for connection in idle_connections:
+                    connection.close()
+            self._idle_connections = {}
+
+    def format_stats(self):
+        reuse_percentage = 0
+        if self.request_count:
+            reuse_percentage = 100 * self.reuse_count / self.request_count
+        return ("%d requests, %d connections opened, "
+                "%d requests over reused connections (%.1f%%)" %
+                (self.request_count, self.connection_count,
+                 self.reuse_count, reuse_percentage))
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import contextlib
+import heapq
+import json
+import os
+import resource
+import threading
+import time
+
+STAGES = (
+    STAGE_THROTTLE,
+    STAGE_NETWORK,
+    STAGE_PARSE,
+    STAGE_WRITE,
+    ) = (
+    "throttle",
+    "network",
+    "parse",
+    "write",
+    )
+
+# Fields of KTweb pages the parsers measure when profiling: the soup of
+# each page, the meeting document type from the index page, the cover
+# page, and the text of agenda item paragraphs and each field extracted
+# from it.
+PARSE_FIELDS = (
+    "soup",
+    "type",
+    "cover_page",
+    "text",
+    "subject",
+    "dnro",
+    "preparers",
+    "introducers",
+    "resolution",
+    "proposal",
+    )
+
+class Instrumentation(object):
+    """Hooks called by the downloader and parsers, which do nothing.
+
+    The downloader calls the hooks from all of its worker threads.
+    Durations are in seconds.
+
+    """
+
+    # Parsers measure each field only if this is true, because measuring
+    # them slows parsing down.
+    profiles_parsing = False
+
+    @contextlib.contextmanager
+    def context(self, name):
+        """Attribute everything recorded by this thread to `name`."""
+        yield
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """Record the duration of the with-block as `stage`."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start_time)
+
+    def record(self, stage, duration):
+        pass
+
+    def record_request(self, url, status, duration, byte_count):
+        # status is None if no response was received.
+        pass
+
+    def start_meeting_documents(self, count):
+        pass
+
+    def finish_meeting_document(self, url, is_complete):
+        pass
+
+    def record_parse(self, filepath, durations):
+        # Called once per parsed page if profiles_parsing is true,
+        # durations is a dict of seconds per field in PARSE_FIELDS.
+        pass
+
+# Histogram bucket upper bounds in seconds, from 1 ms doubling up to
+# about 2 minutes. Slower samples end up in the last, unbounded bucket.
+_BUCKET_BOUNDS = tuple(0.001 * 2 ** i for i in range(18))
+
+class Histogram(object):
+    """Histogram of durations with logarithmic buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bucket_counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        for i, bound in enumerate(_BUCKET_BOUNDS):
+            if value <= bound:
+                break
+        else:
+            i = len(_BUCKET_BOUNDS)
+        self.bucket_counts[i] += 1
+
+    def to_dict(self):
+        # Only non-empty buckets are listed, keyed by their upper bound
+        # in milliseconds ("inf" for the last one).
+        buckets = {}
+        for i, bucket_count in enumerate(self.bucket_counts):
+            if not bucket_count:
+                continue
+            if i < len(_BUCKET_BOUNDS):
+                key = "%g" % (1000 * _BUCKET_BOUNDS[i])
+            else:
+                key = "inf"
+            buckets[key] = bucket_count
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "buckets_ms": buckets,
+            }
+
+class _ContextStats(object):
+
+    def __init__(self):
+        self.histograms = dict((stage, Histogram()) for stage in STAGES)
+        self.status_counts = {}
+        self.byte_count = 0
+        self.complete_count = 0
+        self.incomplete_count = 0
+
+    def to_dict(self):
+        return {
+            "stages": dict((stage, histogram.to_dict())
+                           for stage, histogram in self.histograms.items()),
+            "requests": dict((str(status), count) for status, count
+                             in self.status_counts.items()),
+            "bytes": self.byte_count,
+            "meeting_documents": {
+                "complete": self.complete_count,
+                "incomplete": self.incomplete_count,
+                },
+            }
+
+class DownloadStats(Instrumentation):
+    """Instrumentation collecting histograms per context.
+
+    The downloader uses policymaker listing URLs as context names.
+    Stats can be written as JSON lines, one line per context and the
+    total last, with write_json_lines(). If `progress_file` is given, a
+    progress line is written to it at most every `progress_interval`
+    seconds as meeting documents finish.
+
+    """
+
+    def __init__(self, progress_file=None, progress_interval=10):
+        self.progress_file = progress_file
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._contexts = {}
+        self._total = _ContextStats()
+        self._start_time = time.time()
+        self._progress_time = 0
+        self._meeting_document_count = 0
+
+    @contextlib.contextmanager
+    def context(self, name):
+        previous_name = getattr(self._local, "name", None)
+        self._local.name = name
+        try:
+            yield
+        finally:
+            self._local.name = previous_name
+
+    def _get_stats(self):
+        # Must be called with the lock held.
+        name = getattr(self._local, "name", None)
+        try:
+            return self._contexts[name]
+        except KeyError:
+            stats = _ContextStats()
+            self._contexts[name] = stats
+            return stats
+
+    def record(self, stage, duration):
+        with self._lock:
+            self._get_stats().histograms[stage].add(duration)
+            self._total.histograms[stage].add(duration)
+
+    def record_request(self, url, status, duration, byte_count):
+        with self._lock:
+            for stats in (self._get_stats(), self._total):
+                stats.histograms[STAGE_NETWORK].add(duration)
+                stats.status_counts[status] = stats.status_counts.get(status, 0) + 1
+                stats.byte_count += byte_count
+
+    def start_meeting_documents(self, count):
+        with self._lock:
+            self._meeting_document_count += count
+
+    def finish_meeting_document(self, url, is_complete):
+        with self._lock:
+            for stats in (self._get_stats(), self._total):
+                if is_complete:
+                    stats.complete_count += 1
+                else:
+                    stats.incomplete_count += 1
+            self._write_progress()
+
+    def _write_progress(self):
+        # Must be called with the lock held.
+        if self.progress_file is None:
+            return
+        now = time.time()
+        if now - self._progress_time < self.progress_interval:
+            return
+        self._progress_time = now
+
+        total = self._total
+        elapsed_time = now - self._start_time
+        request_count = sum(total.status_counts.values())
+        print("%d/%d meeting documents (%d incomplete), %d requests, "
+              "%.1f MB, %.1f requests/s, %.0f s" % (
+                total.complete_count + total.incomplete_count,
+                self._meeting_document_count,
+                total.incomplete_count,
+                request_count,
+                total.byte_count / 1024 / 1024,
+                request_count / elapsed_time if elapsed_time else 0,
+                elapsed_time), file=self.progress_file)
+        self.progress_file.flush()
+
+    def summarize(self):
+        """Return a list of stats dicts, one per context and the total last."""
+        with self._lock:
+            summary = []
+            for name in sorted(self._contexts, key=lambda n: (n is None, n)):
+                context_summary = {"context": name}
+                context_summary.update(self._contexts[name].to_dict())
+                summary.append(context_summary)
+            total_summary = {"context": "total",
+                             "wall_time": time.time() - self._start_time}
+            total_summary.update(self._total.to_dict())
+            summary.append(total_summary)
+        return summary
+
+    def write_json_lines(self, f):
+        for context_summary in self.summarize():
+            print(json.dumps(context_summary, sort_keys=True), file=f)
+
+class ParseTimings(Instrumentation):
+    """Instrumentation logging parse durations of each page.
+
+    The log can be taken with pop() after each meeting document, e.g. to
+    pass it from a worker process to a ParseProfile in the main process.
+
+    """
+
+    profiles_parsing = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = []
+
+    def record_parse(self, filepath, durations):
+        with self._lock:
+            self._timings.append((filepath, durations))
+
+    def pop(self):
+        """Return and clear the list of (filepath, durations) recorded."""
+        with self._lock:
+            timings = self._timings
+            self._timings = []
+        return timings
+
+class ParseProfile(Instrumentation):
+    """Instrumentation aggregating parse durations per page and field.
+
+    Keeps the total duration of each field and the `top_count` slowest
+    pages and (page, field) pairs, so that memory use does not grow with
+    the number of pages. A report can be written with write_report().
+
+    """
+
+    profiles_parsing = True
+
+    def __init__(self, top_count=10):
+        self.top_count = top_count
+        self._lock = threading.Lock()
+        self._field_totals = dict((field, 0.0) for field in PARSE_FIELDS)
+        self._page_count = 0
+        # Min-heaps of the slowest ones seen so far.
+        self._slowest_pages = []
+        self._slowest_fields = []
+
+    def _push(self, heap, item):
+        # Must be called with the lock held.
+        if len(heap) < self.top_count:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def record_parse(self, filepath, durations):
+        with self._lock:
+            self._page_count += 1
+            for field, duration in durations.items():
+                self._field_totals[field] = (self._field_totals.get(field, 0.0)
+                                             + duration)
+                self._push(self._slowest_fields, (duration, filepath, field))
+            self._push(self._slowest_pages,
+                       (sum(durations.values()), filepath, durations))
+
+    def update(self, timings):
+        """Record a list of (filepath, durations), see ParseTimings.pop()."""
+        for filepath, durations in timings:
+            self.record_parse(filepath, durations)
+
+    def slowest_pages(self):
+        """Return a list of (total, filepath, durations), slowest first."""
+        with self._lock:
+            return sorted(self._slowest_pages, reverse=True)
+
+    def slowest_fields(self):
+        """Return a list of (duration, filepath, field), slowest first."""
+        with self._lock:
+            return sorted(self._slowest_fields, reverse=True)
+
+    def field_totals(self):
+        """Return a list of (total, field), slowest first."""
+        with self._lock:
+            return sorted(((total, field) for field, total
+                           in self._field_totals.items()), reverse=True)
+
+    def write_report(self, f):
+        field_totals = self.field_totals()
+        total = sum(field_total for field_total, _ in field_totals)
+        print("Parsed %d pages in %.2f s" % (self._page_count, total), file=f)
+
+        print("\nTime by field:", file=f)
+        for field_total, field in field_totals:
+            print("%10.3f s %5.1f %%  %s" % (
+                    field_total, 100 * field_total / total if total else 0,
+                    field), file=f)
+
+        print("\nSlowest pages:", file=f)
+        for page_total, filepath, durations in self.slowest_pages():
+            # The three slowest fields of each page are enough to tell
+            # what is wrong with it.
+            fields = sorted(((duration, field) for field, duration
+                             in durations.items()), reverse=True)[:3]
+            print("%10.3f s  %s (%s)" % (
+                    page_total, filepath,
+                    ", ".join("%s %.3f s" % (field, duration)
+                              for duration, field in fields)), file=f)
+
+        print("\nSlowest fields:", file=f)
+        for duration, filepath, field in self.slowest_fields():
+            print("%10.3f s  %s  %s" % (duration, field, filepath), file=f)
+
+_PAGE_SIZE = resource.getpagesize()
+
+def get_rss():
+    """Return the resident set size of this process in bytes.
+
+    Returns None if it cannot be read, e.g. on systems without /proc.
+
+    """
+    try:
+        with open("/proc/%d/statm" % os.getpid()) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, ValueError, IndexError):
+        return None
+
+def get_max_rss(who=resource.RUSAGE_SELF):
+    """Return the peak resident set size in bytes, see getrusage(2)."""
+    # Linux reports kilobytes.
+    return resource.getrusage(who).ru_maxrss * 1024
+
+class MemoryProfile(object):
+    """Peak resident set size by stage.
+
+    Samples of the RSS are taken by the caller with sample() at the end
+    of each step of a stage, e.g. after each parsed document. Samples
+    taken in other processes can be recorded with record(). The peak of
+    each stage is the largest of its samples, which is not necessarily
+    the true peak, but tells which stage the memory goes to and whether
+    it keeps growing.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = []
+        self._peaks = {}
+        self._first_samples = {}
+        self._last_samples = {}
+
+    def record(self, stage, rss):
+        if rss is None:
+            return
+        with self._lock:
+            if stage not in self._peaks:
+                self._stages.append(stage)
+                self._peaks[stage] = rss
+                self._first_samples[stage] = rss
+            self._peaks[stage] = max(self._peaks[stage], rss)
+            self._last_samples[stage] = rss
+
+    def sample(self, stage):
+        self.record(stage, get_rss())
+
+    def write_report(self, f):
+        print("Peak RSS by stage:", file=f)
+        with self._lock:
+            for stage in self._stages:
+                print("%10.1f MB  %s (first %.1f MB, last %.1f MB)" % (
+                        self._peaks[stage] / 1024 / 1024, stage,
+                        self._first_samples[stage] / 1024 / 1024,
+                        self._last_samples[stage] / 1024 / 1024), file=f)
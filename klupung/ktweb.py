@@ -19,132 +19,775 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import absolute_import
 
+import contextlib
 import datetime
 import errno
-import glob
+import fnmatch
+import functools
+import hashlib
+import io
+import mmap
 import os
 import os.path
 import re
 import sys
-import tempfile
+import threading
 import time
 import traceback
+import zipfile
+import zlib
 
 from codecs import open
 
-from urllib2 import urlopen
 from urlparse import urljoin, urlsplit
 
 import bs4
 
+import klupung.httppool
+import klupung.instrumentation
+import klupung.manifest
+import klupung.util
+
 _COVER_PAGE_FILENAME = "htmtxt0.htm"
 
-def is_meeting_document_dir(dirpath):
-    for dirpath, dirnames, filenames in os.walk(dirpath):
-        if not _COVER_PAGE_FILENAME in filenames:
-            return False
-        break
-    return True
+# os.scandir() (Python 3.5+, or the scandir package) tells directories
+# from files without stat'ing them on most platforms.
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+def _list_dir(dirpath):
+    # Returns sorted lists of the names of the subdirectories and other
+    # entries of dirpath. Each entry is stat'ed at most once.
+    dirnames = []
+    filenames = []
+    if _scandir is not None:
+        for entry in _scandir(dirpath):
+            if entry.is_dir():
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+    else:
+        for name in os.listdir(dirpath):
+            if os.path.isdir(os.path.join(dirpath, name)):
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+    dirnames.sort()
+    filenames.sort()
+    return dirnames, filenames
 
-def _make_soup(filepath, encoding="utf-8"):
-    with open(filepath, encoding=encoding, errors="replace") as f:
-        return bs4.BeautifulSoup(f, from_encoding=encoding)
+def is_meeting_document_dir(dirpath):
+    if os.path.isfile(dirpath + _PACK_SUFFIX):
+        return True
+    try:
+        filenames = os.listdir(dirpath)
+    except OSError:
+        return False
+    return (_COVER_PAGE_FILENAME in filenames
+            or _COVER_PAGE_FILENAME + _RAW_SUFFIX in filenames)
+
+def iter_meeting_document_dirpaths(dirpath, policymakers=None, since=None):
+    # Yields paths of meeting documents, directories and packs (without
+    # _PACK_SUFFIX), in dirpath in sorted order. Each directory is
+    # listed once and directories of meeting documents are not
+    # descended into.
+    #
+    # If policymakers (abbreviations) or since (datetime.date) is
+    # given, dirpath is the paatokset directory, laid out as
+    # <policymaker>/<year>/<ddmmhhmm>, and only meeting documents of
+    # the given policymakers, dated on or after since by their year and
+    # directory names, are yielded. Other directories are not listed.
+    for meeting_document_dirpath, filenames in iter_meeting_document_listings(
+        dirpath, policymakers=policymakers, since=since):
+        yield meeting_document_dirpath
+
+def iter_meeting_document_listings(dirpath, policymakers=None, since=None):
+    # Like iter_meeting_document_dirpaths(), but yields (dirpath,
+    # filenames) pairs. filenames is the listing of the directory of
+    # the meeting document taken during the walk, or None if the
+    # meeting document has a pack and the reader has to decide whether
+    # to read the directory or the pack. Pass it on to
+    # open_meeting_document() and friends so that the directory is not
+    # listed again.
+    if isinstance(since, datetime.datetime):
+        since = since.date()
+    return _iter_meeting_document_dirpaths(dirpath, (), policymakers, since)
+
+def _is_pruned(relnames, policymakers, since):
+    # relnames are the names of the path components of a directory
+    # relative to the paatokset directory.
+    if policymakers is not None and relnames[0] not in policymakers:
+        return True
+    if since is None or len(relnames) < 2:
+        return False
+    try:
+        year = int(relnames[1])
+    except ValueError:
+        return False
+    if len(relnames) == 2:
+        return year < since.year
+    if len(relnames) > 3:
+        return False
+    dirname = relnames[2]
+    try:
+        date = datetime.date(year, int(dirname[2:4]), int(dirname[:2]))
+    except ValueError:
+        return False
+    return date < since
 
-def _cleanup_soup(soup):
-    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Comment)):
-        tag.extract()
+def _iter_meeting_document_dirpaths(dirpath, relnames, policymakers, since):
+    try:
+        dirnames, filenames = _list_dir(dirpath)
+    except OSError:
+        # Like os.walk(), skip directories which cannot be listed.
+        return
+
+    if (_COVER_PAGE_FILENAME in filenames
+        or _COVER_PAGE_FILENAME + _RAW_SUFFIX in filenames):
+        yield dirpath, filenames
+        return
+
+    for filename in filenames:
+        if not filename.endswith(_PACK_SUFFIX):
+            continue
+        dirname = filename[:-len(_PACK_SUFFIX)]
+        # The directory of a packed meeting document, if it still
+        # exists, is not walked, the reader decides whether to read
+        # the directory or the pack.
+        if dirname in dirnames:
+            dirnames.remove(dirname)
+        if _is_pruned(relnames + (dirname,), policymakers, since):
+            continue
+        yield os.path.join(dirpath, dirname), None
 
-    for tag in soup.find_all(text=lambda t: isinstance(t, bs4.Declaration)):
-        tag.extract()
+    for dirname in dirnames:
+        subrelnames = relnames + (dirname,)
+        if _is_pruned(subrelnames, policymakers, since):
+            continue
+        for listing in _iter_meeting_document_dirpaths(
+            os.path.join(dirpath, dirname), subrelnames, policymakers, since):
+            yield listing
+
+# Pages downloaded in raw mode are stored as they were received to
+# <page>.raw, and the encoding they were received in to <page>.encoding.
+# The clean <page> is produced from them when it is needed for the
+# first time and reused as long as the raw page stays the same.
+_RAW_SUFFIX = ".raw"
+_ENCODING_SUFFIX = ".encoding"
+
+def _clean_raw_page(filepath):
+    # Returns True if the clean page was (re)written.
+    raw_filepath = filepath + _RAW_SUFFIX
+    try:
+        raw_mtime = os.path.getmtime(raw_filepath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+        return False
 
-    for tag in soup("style"):
-        tag.extract()
+    try:
+        if os.path.getmtime(filepath) >= raw_mtime:
+            return False
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise e
 
-    for tag in soup("meta"):
-        tag.extract()
+    with open(filepath + _ENCODING_SUFFIX) as f:
+        encoding = f.readline().strip()
+    with open(raw_filepath, "rb") as f:
+        clean_soup = _make_clean_soup(f.read(), encoding)
+    _print_to_file(filepath, clean_soup)
+    return True
 
-    for tag in soup.find_all():
-        attrs = tag.attrs
-        saved_attrs = set(["class", "href", "target"]) & set(attrs.keys())
-        tag.attrs = {a: attrs[a] for a in saved_attrs}
+def clean_raw_pages(dirpath):
+    for dirpath, dirnames, filenames in os.walk(dirpath):
+        for filename in filenames:
+            if not filename.endswith(_RAW_SUFFIX):
+                continue
+            filepath = os.path.join(dirpath, filename[:-len(_RAW_SUFFIX)])
+            if _clean_raw_page(filepath):
+                yield filepath
+
+# Meeting documents can be packed to <ddmmhhmm>.zip next to their
+# <ddmmhhmm> directory, to be read with a few large sequential reads
+# instead of opening dozens of small files. Packs are read-only copies
+# made after the download: the directory stays the place where pages
+# are written to, and the pack is read only as long as it is at least
+# as new as the directory (or if the directory has been removed).
+_PACK_SUFFIX = ".zip"
+_PACKED_FILENAME_PATTERNS = ("*.htm", "origin_url", "*.geometries.json")
+
+# Files parse_meeting_document() reads.
+_PARSED_FILENAME_PATTERNS = ("*.htm", "origin_url")
+
+def _is_parsed_filename(filename):
+    for pattern in _PARSED_FILENAME_PATTERNS:
+        if fnmatch.fnmatch(filename, pattern):
+            return True
+    return False
+
+# Increment whenever parse_meeting_document() results change, cached
+# results of older versions are not used then and fingerprints of all
+# meeting documents change. See stat_key() and content_key() below.
+_PARSER_VERSION = 2
+
+def _make_cache_key(entries):
+    return hashlib.sha1(repr((_PARSER_VERSION, entries))).hexdigest()
+
+class _MeetingDocumentFiles(object):
+    # Files of a meeting document, see open_meeting_document().
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+class _MeetingDocumentDir(_MeetingDocumentFiles):
+    # Files of a meeting document stored in a directory. The directory
+    # is listed once, or not at all if its listing is given. Each file
+    # is read once for both the content key and parsing: the content
+    # key is computed from the files already read, and files read only
+    # for it are kept until they are read for parsing.
+
+    def __init__(self, dirpath, filenames=None):
+        _MeetingDocumentFiles.__init__(self, dirpath)
+        if filenames is None:
+            filenames = os.listdir(dirpath)
+        self._filenames = sorted(filenames)
+        self._namelist = None
+        self._stat_key = None
+        self._content_key = None
+        # Sizes and CRC-32s of the parsed files read so far, by name.
+        self._checksums = {}
+        # Files read for the content key but not yet parsed, by name.
+        self._unparsed_files = {}
+
+    def namelist(self):
+        if self._namelist is None:
+            filenames = set()
+            for filename in self._filenames:
+                if filename.endswith(_RAW_SUFFIX):
+                    filename = filename[:-len(_RAW_SUFFIX)]
+                filenames.add(filename)
+            self._namelist = sorted(filenames)
+        return self._namelist
+
+    def read(self, filename):
+        data = self._unparsed_files.pop(filename, None)
+        if data is not None:
+            return data
+        filepath = os.path.join(self.dirpath, filename)
+        if _clean_raw_page(filepath):
+            # A clean page was written, it is part of the stat key.
+            self._stat_key = None
+        with open(filepath, "rb") as f:
+            data = f.read()
+        if _is_parsed_filename(filename):
+            self._checksums[filename] = (len(data),
+                                         zlib.crc32(data) & 0xffffffff)
+        return data
+
+    def getmtime(self, filename):
+        filepath = os.path.join(self.dirpath, filename)
+        try:
+            return os.path.getmtime(filepath)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, filepath)
+
+    def stat_key(self):
+        # Key of the names, sizes and mtimes of the files to be parsed,
+        # including the raw pages they are cleaned from. Clean pages
+        # written since the directory was listed are included too, so
+        # the key is the same as that of a fresh listing.
+        if self._stat_key is not None:
+            return self._stat_key
+        filenames = set(self._filenames)
+        for filename in self._filenames:
+            if filename.endswith(_RAW_SUFFIX):
+                filenames.add(filename[:-len(_RAW_SUFFIX)])
+        entries = []
+        for filename in sorted(filenames):
+            clean_filename = filename
+            for suffix in (_RAW_SUFFIX, _ENCODING_SUFFIX):
+                if clean_filename.endswith(suffix):
+                    clean_filename = clean_filename[:-len(suffix)]
+            if not _is_parsed_filename(clean_filename):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dirpath, filename))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise e
+                continue
+            entries.append((filename, st.st_size, st.st_mtime))
+        self._stat_key = _make_cache_key(entries)
+        return self._stat_key
+
+    def content_key(self):
+        # Key of the names, sizes and CRC-32s of the files to be
+        # parsed, same as the content key of the pack of the same files.
+        if self._content_key is not None:
+            return self._content_key
+        entries = []
+        for filename in self.namelist():
+            if not _is_parsed_filename(filename):
+                continue
+            if filename not in self._checksums:
+                self._unparsed_files[filename] = self.read(filename)
+            entries.append((filename,) + self._checksums[filename])
+        self._content_key = _make_cache_key(entries)
+        return self._content_key
+
+class _MmapFile(object):
+    # Read-only file object on top of a memory map. ZipFile calls
+    # read() without the size, which mmap objects of Python 2 do not
+    # accept, and expects seek() to raise IOError like files do when
+    # it looks for the end of a truncated archive.
+
+    def __init__(self, mmap_):
+        self._mmap = mmap_
+        self.tell = mmap_.tell
+
+    def seek(self, offset, whence=0):
+        try:
+            self._mmap.seek(offset, whence)
+        except ValueError:
+            raise IOError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self._mmap) - self._mmap.tell()
+        return self._mmap.read(size)
+
+class _MeetingDocumentPack(_MeetingDocumentFiles):
+    # Files of a meeting document stored in a pack. The pack is mapped
+    # to memory and members are decompressed directly from the map.
+
+    def __init__(self, dirpath):
+        _MeetingDocumentFiles.__init__(self, dirpath)
+        with open(dirpath + _PACK_SUFFIX, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped.
+                raise zipfile.BadZipfile("File is not a zip file")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._zipfile = zipfile.ZipFile(_MmapFile(self._mmap))
+        except:
+            self._mmap.close()
+            raise
 
-    for tag in soup.find_all(text=True):
-        tag.replace_with(re.sub(r"\r", "", tag.string))
+    def namelist(self):
+        return sorted(self._zipfile.namelist())
 
-    return soup
+    def read(self, filename):
+        try:
+            return self._zipfile.read(filename)
+        except KeyError:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT),
+                          os.path.join(self.dirpath + _PACK_SUFFIX, filename))
 
-def _print_to_file(filepath, printable):
-    # Make the target directory with all the leading components, do not
-    # care whether the the directory exists or not.
-    dirpath = os.path.dirname(filepath)
+    def getmtime(self, filename):
+        try:
+            zipinfo = self._zipfile.getinfo(filename)
+        except KeyError:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT),
+                          os.path.join(self.dirpath + _PACK_SUFFIX, filename))
+        return time.mktime(zipinfo.date_time + (0, 0, -1))
+
+    def stat_key(self):
+        st = os.stat(self.dirpath + _PACK_SUFFIX)
+        return _make_cache_key([(_PACK_SUFFIX, st.st_size, st.st_mtime)])
+
+    def content_key(self):
+        # The pack has the sizes and CRC-32s of its members already,
+        # no need to read them.
+        entries = []
+        for zipinfo in sorted(self._zipfile.infolist(),
+                              key=lambda zipinfo: zipinfo.filename):
+            if not _is_parsed_filename(zipinfo.filename):
+                continue
+            entries.append((zipinfo.filename, zipinfo.file_size, zipinfo.CRC))
+        return _make_cache_key(entries)
+
+    def close(self):
+        self._zipfile.close()
+        self._mmap.close()
+
+def _is_pack_fresh(dirpath):
     try:
-        os.makedirs(dirpath)
+        pack_mtime = os.path.getmtime(dirpath + _PACK_SUFFIX)
     except OSError as e:
-        if e.errno != errno.EEXIST:
+        if e.errno != errno.ENOENT:
             raise e
+        return False
 
-    # Write the contents to a temporary file first, because the
-    # existence of the real filepath can be used as an indicator to not
-    # re-download and re-write the file again but just read its current
-    # value. Writing to a temporary file and then renaming it to its
-    # final name guarantees that the contents of the final path is
-    # always complete.
-    tmp_file = tempfile.NamedTemporaryFile(dir=dirpath, delete=False)
     try:
-        print(printable, file=tmp_file)
-        tmp_file.close()
-    except:
-        # Something went wrong when writing to the file. Signal
-        # interrupted, fs failed, anything.
+        return os.path.getmtime(dirpath) <= pack_mtime
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+        return True
+
+def open_meeting_document(dirpath, filenames=None):
+    # Returns an object with namelist(), read(filename),
+    # getmtime(filename) and close() methods for reading the files of
+    # the meeting document in dirpath either from its directory or from
+    # its pack, whichever is up to date. read() and getmtime() raise
+    # IOError with errno ENOENT if the file does not exist.
+    #
+    # If filenames, the listing of a meeting document without a pack
+    # (see iter_meeting_document_listings()), is given, the directory
+    # is read without looking for a pack or listing it again.
+    if filenames is not None:
+        return _MeetingDocumentDir(dirpath, filenames)
+    if _is_pack_fresh(dirpath):
+        return _MeetingDocumentPack(dirpath)
+    return _MeetingDocumentDir(dirpath)
+
+def _pack_meeting_document(dirpath, filenames=None):
+    meeting_document = _MeetingDocumentDir(dirpath, filenames)
+
+    data = io.BytesIO()
+    with contextlib.closing(zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED)) as pack:
+        for filename in meeting_document.namelist():
+            for pattern in _PACKED_FILENAME_PATTERNS:
+                if fnmatch.fnmatch(filename, pattern):
+                    pack.writestr(filename, meeting_document.read(filename))
+                    break
+
+    _write_to_file(dirpath + _PACK_SUFFIX, data.getvalue())
+
+def pack_meeting_documents(dirpath):
+    for meeting_document_dirpath, filenames in iter_meeting_document_listings(
+        dirpath):
+        # Meeting documents listed during the walk have no pack yet.
+        if filenames is None:
+            if not os.path.isdir(meeting_document_dirpath):
+                continue
+            if _is_pack_fresh(meeting_document_dirpath):
+                continue
+        _pack_meeting_document(meeting_document_dirpath, filenames)
+        yield meeting_document_dirpath + _PACK_SUFFIX
+
+def read_page(filepath):
+    # Returns the contents of the page in filepath, cleaned from the raw
+    # page first if the page was downloaded in raw mode.
+    _clean_raw_page(filepath)
+    with open(filepath, "rb") as f:
+        return f.read()
+
+class ParseBackend(object):
+    # Builds soups of whole pages with the given BeautifulSoup tree
+    # builder features, by default with the best available builder.
+    # This is how pages have always been parsed.
+
+    def __init__(self, features=None):
+        if features is not None:
+            if bs4.builder.builder_registry.lookup(*features.split()) is None:
+                raise ValueError("tree builder is not available: %r" % features)
+        self.features = features
+
+    def make_soup(self, markup, parse_only=None):
+        return bs4.BeautifulSoup(markup, self.features)
+
+class LxmlParseBackend(object):
+    # Parses pages with lxml and builds read-only soups of only the
+    # elements matching the strainer given by the caller, see
+    # klupung.lxmlsoup. Several times faster than ParseBackend, mostly
+    # because no BeautifulSoup tree is built at all.
+
+    def __init__(self):
+        # lxml is an optional dependency.
+        import klupung.lxmlsoup
+        self._soup_class = klupung.lxmlsoup.LxmlSoup
+
+    def make_soup(self, markup, parse_only=None):
+        return self._soup_class(markup, parse_only)
+
+PARSE_BACKEND_NAMES = ("default", "lxml")
+
+def make_parse_backend(name):
+    if name == "default":
+        return ParseBackend()
+    if name == "lxml":
+        return LxmlParseBackend()
+    raise ValueError("invalid parse backend name %r, expected one of %s" %
+                     (name, ", ".join(repr(n) for n in PARSE_BACKEND_NAMES)))
+
+# All pages are parsed with the same backend, see set_parse_backend().
+_parse_backend = ParseBackend()
+
+def set_parse_backend(parse_backend):
+    global _parse_backend
+    _parse_backend = parse_backend
+
+def _make_soup(data, encoding="utf-8", parse_only=None):
+    # parse_only is a bs4.SoupStrainer matching the elements the caller
+    # needs, backends are free to build the soup of the whole page.
+    with _instrumentation.measure(klupung.instrumentation.STAGE_PARSE):
+        return _parse_backend.make_soup(data.decode(encoding, "replace"),
+                                        parse_only)
+
+def _dispose_soup(soup):
+    # Soups are full of reference cycles (parents, siblings and children
+    # refer to each other), so without this they stay in memory until
+    # the cyclic garbage collector gets around to them. Nothing taken
+    # from the soup can be used after this but plain strings.
+    soup.decompose()
+
+# Pages are cleaned from comments, declarations, style and meta
+# elements, attributes other than the ones below and carriage returns.
+_SAVED_ATTRS = frozenset(["class", "href", "target"])
+_REMOVED_TAG_NAMES = frozenset(["style", "meta"])
+_REMOVED_STRING_TYPES = (bs4.Comment, bs4.Declaration)
+
+def _clean_attrs(attrs):
+    return {a: attrs[a] for a in _SAVED_ATTRS.intersection(attrs)}
+
+def _clean_string(string):
+    # Other special strings (doctypes, CDATA, processing instructions)
+    # are kept but as plain text.
+    if type(string) is bs4.NavigableString and u"\r" not in string:
+        return None
+    return bs4.NavigableString(string.replace(u"\r", u""))
+
+def _cleanup_soup(soup):
+    # Clean the soup in a single walk over the tree.
+    tags = [soup]
+    while tags:
+        tag = tags.pop()
+        # Iterate over a copy, children are removed and replaced.
+        for child in list(tag.contents):
+            if isinstance(child, bs4.Tag):
+                if child.name in _REMOVED_TAG_NAMES:
+                    child.extract()
+                    continue
+                child.attrs = _clean_attrs(child.attrs)
+                tags.append(child)
+            elif isinstance(child, _REMOVED_STRING_TYPES):
+                child.extract()
+            else:
+                clean_string = _clean_string(child)
+                if clean_string is not None:
+                    child.replace_with(clean_string)
+    return soup
+
+class _CleanSoup(bs4.BeautifulSoup):
+    # BeautifulSoup which cleans the markup while the tree is being
+    # built, the same way as _cleanup_soup() would clean the complete
+    # tree afterwards: unwanted strings and attributes never make it
+    # to the tree and removed elements are extracted in one go after
+    # the parse.
+
+    def __init__(self, *args, **kwargs):
+        self._removed_tags = []
+        bs4.BeautifulSoup.__init__(self, *args, **kwargs)
+        for tag in self._removed_tags:
+            tag.extract()
+        del self._removed_tags
+        if "html5lib" in self.builder.features:
+            # The html5lib tree builder builds the tree by itself,
+            # bypassing the callbacks below.
+            _cleanup_soup(self)
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs):
+        if attrs:
+            attrs = _clean_attrs(attrs)
+        tag = bs4.BeautifulSoup.handle_starttag(self, name, namespace,
+                                                nsprefix, attrs)
+        if tag is not None and tag.name in _REMOVED_TAG_NAMES:
+            self._removed_tags.append(tag)
+        return tag
+
+    def object_was_parsed(self, o, *args, **kwargs):
+        # Plain strings without carriage returns are by far the most
+        # common objects, let them through as fast as possible.
+        if type(o) is not bs4.NavigableString or u"\r" in o:
+            if isinstance(o, _REMOVED_STRING_TYPES):
+                return
+            if isinstance(o, bs4.NavigableString):
+                o = _clean_string(o)
+        bs4.BeautifulSoup.object_was_parsed(self, o, *args, **kwargs)
+
+def _make_clean_soup(markup, encoding="utf-8"):
+    with _instrumentation.measure(klupung.instrumentation.STAGE_PARSE):
+        return _CleanSoup(markup, from_encoding=encoding)
+
+def _print_to_file(filepath, printable):
+    _write_to_file(filepath, "%s\n" % printable)
+
+def _write_to_file(filepath, data):
+    with _instrumentation.measure(klupung.instrumentation.STAGE_WRITE):
+        klupung.util.write_to_file_atomically(filepath, data)
+
+class _TokenBucket(object):
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self):
+        # Tokens are reserved under the lock and the bucket is allowed
+        # to go negative: each caller then sleeps its own share outside
+        # the lock, which keeps concurrent callers queued in order
+        # without holding the lock for the duration of the pause.
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._timestamp
+            self._timestamp = now
+            self._tokens = min(self.capacity,
+                               self._tokens + elapsed * self.rate)
+            self._tokens -= 1
+            pause = max(-self._tokens / self.rate, 0)
+        time.sleep(pause)
+        return pause
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def _throttle(url, min_interval=1, burst=1):
+    if min_interval <= 0:
+        return 0
+
+    host = urlsplit(url).netloc
+    rate = 1 / min_interval
+    with _rate_limiters_lock:
         try:
-            tmp_file.close()
-        finally:
-            os.remove(tmp_file.name)
+            rate_limiter = _rate_limiters[host]
+        except KeyError:
+            rate_limiter = _TokenBucket(rate, burst)
+            _rate_limiters[host] = rate_limiter
+        else:
+            rate_limiter.rate = rate
+            rate_limiter.capacity = burst
+
+    return rate_limiter.consume()
+
+# All page downloads go through the same pool of keep-alive
+# connections, see set_connection_pool().
+_connection_pool = klupung.httppool.ConnectionPool()
+
+def set_connection_pool(connection_pool):
+    global _connection_pool
+    _connection_pool = connection_pool
+
+# Time spent in each stage of the download (throttling, network,
+# parsing and writing), requests and finished meeting documents are
+# reported to the instrumentation, see set_instrumentation() and
+# klupung.instrumentation. So is the time spent on each field of parsed
+# pages, if the instrumentation profiles parsing.
+_instrumentation = klupung.instrumentation.Instrumentation()
+
+def set_instrumentation(instrumentation):
+    global _instrumentation
+    _instrumentation = instrumentation
+
+def _download(url, min_interval=1, burst=1, validators=None):
+    pause = _throttle(url, min_interval=min_interval, burst=burst)
+    _instrumentation.record(klupung.instrumentation.STAGE_THROTTLE, pause)
+
+    headers = {}
+    if validators is not None:
+        etag, last_modified = validators
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+    start_time = time.time()
+    try:
+        response = _connection_pool.urlopen(url, headers)
+    except Exception as e:
+        # HTTP errors have the status code, others (timeouts, refused
+        # connections) do not.
+        _instrumentation.record_request(url, getattr(e, "code", None),
+                                        time.time() - start_time, 0)
         raise
-    else:
-        try:
-            # File written, now let's move it to its final path.
-            os.rename(tmp_file.name, filepath)
-        except:
-            os.remove(tmp_file.name)
-            raise
+    _instrumentation.record_request(url, response.status,
+                                    time.time() - start_time,
+                                    len(response.data))
 
-_last_download_time = None
+    if response.status == 304:
+        # Not modified, the caller already has the latest version.
+        return None, validators
 
-def _download_clean_soup(url, encoding="utf-8", min_interval=1):
-    global _last_download_time
+    validators = (response.headers.getheader("ETag"),
+                  response.headers.getheader("Last-Modified"))
 
-    if _last_download_time is not None:
-        pause = max(_last_download_time - time.time() + min_interval, 0)
-        time.sleep(pause)
+    return response, validators
 
-    response = urlopen(url)
-    _last_download_time = time.time()
+def _download_clean_soup(url, encoding="utf-8", min_interval=1, burst=1,
+                         validators=None):
+    response, validators = _download(url, min_interval=min_interval,
+                                     burst=burst, validators=validators)
+    if response is None:
+        return None, validators
 
-    dirty_soup = bs4.BeautifulSoup(response, from_encoding=encoding)
-    clean_soup = _cleanup_soup(dirty_soup)
-    return clean_soup
+    clean_soup = _make_clean_soup(response.data, encoding)
+    return clean_soup, validators
 
 _DOWNLOAD_PAGE_ERROR_POLICIES = set(("raise", "ignore", "log"))
 _DOWNLOAD_PAGE_ERROR_POLICIES_STR = ' or '.join([repr(s) for s in _DOWNLOAD_PAGE_ERROR_POLICIES])
 def _download_page(url, encoding="utf-8", force=False, min_interval=1,
-                   download_dir=os.path.curdir, error_policy="raise"):
+                   burst=1, download_dir=os.path.curdir, error_policy="raise",
+                   revalidation_store=None, manifest=None, raw=False):
+    # Returns the path of the (clean) page and its clean soup, or the
+    # raw response data if raw is True. The latter is None if the page
+    # was not downloaded because it exists already or has not been
+    # modified. Raw pages are written to the path of the page suffixed
+    # with _RAW_SUFFIX and cleaned only when they are needed, see
+    # read_page().
     if error_policy not in _DOWNLOAD_PAGE_ERROR_POLICIES:
         raise ValueError("error_policy has invalid value (%r), expected %s" %
                          (error_policy, _DOWNLOAD_PAGE_ERROR_POLICIES_STR))
     filepath = os.path.normpath(download_dir + urlsplit(url).path)
-    if force or not os.path.exists(filepath):
+    raw_filepath = filepath + _RAW_SUFFIX
+    write_filepath = raw_filepath if raw else filepath
+
+    if manifest is not None:
+        is_downloaded = manifest.is_page_downloaded(url, filepath, raw_filepath)
+    else:
+        is_downloaded = os.path.exists(filepath) or os.path.exists(raw_filepath)
+
+    if force or not is_downloaded:
+        validators = None
+        if revalidation_store is not None and is_downloaded:
+            cached = revalidation_store.get(url)
+            if cached is not None:
+                validators = cached[:2]
         try:
-            clean_soup = _download_clean_soup(url,
-                                              encoding=encoding,
-                                              min_interval=min_interval)
+            response, validators = _download(url,
+                                             min_interval=min_interval,
+                                             burst=burst,
+                                             validators=validators)
         except Exception, e:
             exc_info = sys.exc_info()
+            if manifest is not None:
+                manifest.mark_page_failed(url, write_filepath,
+                                          "".join(traceback.format_exception(*exc_info)))
             if error_policy == "raise":
                 raise
             if error_policy == "ignore":
                 return None, None
             if error_policy == "log":
+                if manifest is not None:
+                    # Already logged to the manifest.
+                    return None, None
                 try:
                     os.makedirs(os.path.dirname(filepath))
                 except OSError, e:
@@ -153,46 +796,184 @@ def _download_page(url, encoding="utf-8", force=False, min_interval=1,
                 with open("%s.log" % filepath, "a") as error_log:
                     traceback.print_exception(*exc_info, file=error_log)
                 return None, None
-        _print_to_file(filepath, clean_soup)
-        return filepath, clean_soup
+        if response is None:
+            # The page has not changed since it was written to
+            # filepath, no need to parse or rewrite it.
+            if manifest is not None:
+                manifest.mark_page_ok(url, write_filepath)
+            return filepath, None
+
+        if raw:
+            data = response.data
+            retval = data
+        else:
+            clean_soup = _make_clean_soup(response.data, encoding)
+            data = "%s\n" % clean_soup
+            retval = clean_soup
+
+        if manifest is None:
+            is_changed = True
+        else:
+            sha1 = hashlib.sha1(data).hexdigest()
+            page = manifest.get_page(url)
+            is_changed = (page is None or page.sha1 != sha1
+                          or page.filepath != write_filepath)
+
+        if is_changed:
+            if raw:
+                # The encoding must be in place before the raw page
+                # appears, because the existence of the raw page marks
+                # it downloaded.
+                _print_to_file(filepath + _ENCODING_SUFFIX, encoding)
+            _write_to_file(write_filepath, data)
+
+        if manifest is not None:
+            manifest.mark_page_ok(url, write_filepath, sha1)
+
+        if revalidation_store is not None:
+            revalidation_store.update(url, *validators)
+        return filepath, retval
     return filepath, None
 
-def download_meeting_document(meeting_document_url, min_interval=1, force=False, download_dir=os.path.curdir):
-    index_filepath, index_soup = _download_page(meeting_document_url,
-                                                encoding="iso-8859-1",
-                                                force=True, # Refresh indices always.
-                                                min_interval=min_interval,
-                                                download_dir=download_dir,
-                                                error_policy="log")
+def _download_meeting_document(meeting_document_url, min_interval=1, burst=1,
+                               force=False, download_dir=os.path.curdir,
+                               revalidation_store=None, manifest=None,
+                               raw=False):
+    # Returns the meeting document directory (None if even the index
+    # could not be downloaded) and whether all pages were downloaded.
+    if force:
+        revalidation_store = None
+
+    download_page = functools.partial(_download_page,
+                                      min_interval=min_interval,
+                                      burst=burst,
+                                      download_dir=download_dir,
+                                      error_policy="log",
+                                      revalidation_store=revalidation_store,
+                                      manifest=manifest,
+                                      raw=raw)
+
+    # A meeting document is complete when all its pages have been
+    # downloaded successfully. Completeness is recorded in the manifest
+    # or, if it is not used, as the payload of index validators in the
+    # revalidation store.
+    was_complete = False
+    if manifest is not None:
+        previous = manifest.get_meeting_document(meeting_document_url)
+        was_complete = previous is not None and previous.status == klupung.manifest.STATUS_OK
+        manifest.mark_meeting_document(meeting_document_url,
+                                       klupung.manifest.STATUS_PENDING)
+    elif revalidation_store is not None:
+        cached = revalidation_store.get(meeting_document_url)
+        was_complete = cached is not None and cached[2] is True
+
+    index_filepath, index_soup = download_page(meeting_document_url,
+                                               encoding="iso-8859-1",
+                                               force=True) # Refresh indices always.
     if index_filepath is index_soup is None:
-        return None
+        if manifest is not None:
+            manifest.mark_meeting_document(meeting_document_url,
+                                           klupung.manifest.STATUS_FAILED)
+        return None, False
 
     meeting_document_dir = os.path.dirname(index_filepath)
-    _print_to_file(os.path.join(meeting_document_dir, "origin_url"), meeting_document_url)
 
-    cover_page_url = urljoin(meeting_document_url, _COVER_PAGE_FILENAME)
-    _download_page(cover_page_url,
-                   encoding="windows-1252",
-                   force=True,
-                   min_interval=min_interval,
-                   download_dir=download_dir,
-                   error_policy="log")
-
-    for tr in index_soup("table")[0]("tr"):
-        try:
-            agenda_item_number = int(tr("td")[0].text)
-        except ValueError:
-            continue
-        agenda_item_url = urljoin(meeting_document_url,
-                                  "htmtxt%d.htm" % agenda_item_number)
-        _download_page(agenda_item_url, encoding="windows-1252", force=force,
-                       min_interval=min_interval,
-                       download_dir=download_dir, error_policy="log")
+    if raw and index_soup is not None:
+        # Only the links of the index are needed here, cleaning is
+        # left for later like with all raw pages.
+        index_soup = _make_soup(index_soup, encoding="iso-8859-1")
+
+    index_sha1 = None
+    if manifest is not None:
+        index_sha1 = manifest.get_page(meeting_document_url).sha1
+
+    # If the index has not changed since the meeting document was
+    # downloaded completely, neither has the set of its agenda items
+    # and all of them exist already.
+    if index_soup is None:
+        is_unchanged = was_complete
+    elif manifest is not None:
+        is_unchanged = was_complete and previous.index_sha1 == index_sha1
+    else:
+        is_unchanged = False
 
+    if not is_unchanged:
+        if index_soup is None:
+            # The index was found unchanged but the previous download
+            # of the meeting document was interrupted, continue from
+            # where it was left.
+            index_soup = _make_soup(read_page(index_filepath))
+        _print_to_file(os.path.join(meeting_document_dir, "origin_url"), meeting_document_url)
+
+    cover_page_url = urljoin(meeting_document_url, _COVER_PAGE_FILENAME)
+    cover_page_filepath, _ = download_page(cover_page_url,
+                                           encoding="windows-1252",
+                                           force=True)
+    is_complete = cover_page_filepath is not None
+
+    if not is_unchanged:
+        for tr in index_soup("table")[0]("tr"):
+            try:
+                agenda_item_number = int(tr("td")[0].text)
+            except ValueError:
+                continue
+            agenda_item_url = urljoin(meeting_document_url,
+                                      "htmtxt%d.htm" % agenda_item_number)
+            agenda_item_filepath, _ = download_page(agenda_item_url,
+                                                    encoding="windows-1252",
+                                                    force=force,
+                                                    revalidation_store=None)
+            if agenda_item_filepath is None:
+                is_complete = False
+
+    if manifest is not None:
+        if is_complete:
+            status = klupung.manifest.STATUS_OK
+        else:
+            status = klupung.manifest.STATUS_FAILED
+        manifest.mark_meeting_document(meeting_document_url, status,
+                                       dirpath=meeting_document_dir,
+                                       index_sha1=index_sha1)
+
+    if revalidation_store is not None and is_complete:
+        cached = revalidation_store.get(meeting_document_url)
+        if cached is not None:
+            etag, last_modified, _ = cached
+            revalidation_store.update(meeting_document_url, etag,
+                                      last_modified, payload=True)
+
+    return meeting_document_dir, is_complete
+
+def download_meeting_document(meeting_document_url, min_interval=1, burst=1,
+                              force=False, download_dir=os.path.curdir,
+                              revalidation_store=None, manifest=None,
+                              raw=False):
+    meeting_document_dir, _ = _download_meeting_document(
+        meeting_document_url,
+        min_interval=min_interval,
+        burst=burst,
+        force=force,
+        download_dir=download_dir,
+        revalidation_store=revalidation_store,
+        manifest=manifest,
+        raw=raw)
     return meeting_document_dir
 
-def query_meeting_document_urls(url):
-    clean_soup = _download_clean_soup(url, encoding="windows-1252")
+def query_meeting_document_urls(url, min_interval=1, burst=1,
+                                revalidation_store=None):
+    validators = None
+    if revalidation_store is not None:
+        cached = revalidation_store.get(url)
+        if cached is not None and cached[2] is not None:
+            etag, last_modified, cached_urls = cached
+            validators = etag, last_modified
+
+    clean_soup, validators = _download_clean_soup(url, encoding="windows-1252",
+                                                  min_interval=min_interval,
+                                                  burst=burst,
+                                                  validators=validators)
+    if clean_soup is None:
+        return cached_urls
 
     retval = []
     for h3 in clean_soup("h3"):
@@ -201,147 +982,294 @@ def query_meeting_document_urls(url):
             abs_url = urljoin(url, rel_url)
             retval.append(abs_url)
 
+    if revalidation_store is not None:
+        revalidation_store.update(url, *validators, payload=retval)
+
     return retval
 
-def download_policymaker(policymaker_url, min_interval=1, force=False, download_dir=os.path.curdir):
-    meeting_document_urls = query_meeting_document_urls(policymaker_url)
-    for meeting_document_url in meeting_document_urls:
-        meeting_document_dir = download_meeting_document(meeting_document_url,
-                                                         min_interval=min_interval,
-                                                         force=force,
-                                                         download_dir=download_dir)
+def download_policymakers(policymaker_urls, min_interval=1, burst=1,
+                          force=False, download_dir=os.path.curdir,
+                          max_workers=1, revalidation_store=None,
+                          manifest=None, retry_queue=None, raw=False):
+    # Up to max_workers meeting documents are downloaded concurrently
+    # from a single pool shared by all policymakers, so that the pool
+    # does not drain between policymakers. Requests to each host are
+    # throttled with a token bucket which allows burst back-to-back
+    # requests and refills one token per min_interval seconds. Meeting
+    # document directories are yielded in the order they complete.
+    #
+    # If revalidation_store is given, policymaker listings, indices and
+    # cover pages are requested conditionally and unchanged ones are
+    # neither parsed nor rewritten.
+    #
+    # If manifest is given, it is used instead of the filesystem to
+    # decide which pages need to be downloaded and meeting documents
+    # whose previous download was interrupted or failed are downloaded
+    # first.
+    #
+    # If retry_queue is given, meeting documents which could not be
+    # downloaded completely are scheduled to it and downloaded again,
+    # only their missing pages, once all the others are done. Those
+    # which run out of attempts end up in retry_queue.dead_letters.
+    #
+    # If raw is True, pages are stored as they were received and
+    # cleaned only when they are parsed or clean_raw_pages() is called,
+    # which leaves only the indices to be parsed during the download.
+    #
+    # Everything reported to the instrumentation is attributed to the
+    # policymaker listing URL the meeting document was found from.
+    meeting_document_urls = []
+    policymaker_url_by_meeting_document_url = {}
+    for policymaker_url in policymaker_urls:
+        with _instrumentation.context(policymaker_url):
+            urls = query_meeting_document_urls(
+                policymaker_url,
+                min_interval=min_interval,
+                burst=burst,
+                revalidation_store=revalidation_store)
+        meeting_document_urls.extend(urls)
+        for url in urls:
+            policymaker_url_by_meeting_document_url[url] = policymaker_url
+
+    if manifest is not None:
+        meeting_document_urls.sort(key=manifest.is_meeting_document_complete)
+
+    _instrumentation.start_meeting_documents(len(meeting_document_urls))
+
+    def download(meeting_document_url):
+        policymaker_url = policymaker_url_by_meeting_document_url[meeting_document_url]
+        with _instrumentation.context(policymaker_url):
+            meeting_document_dir, is_complete = _download_meeting_document(
+                meeting_document_url,
+                min_interval=min_interval,
+                burst=burst,
+                force=force,
+                download_dir=download_dir,
+                revalidation_store=revalidation_store,
+                manifest=manifest,
+                raw=raw)
+            _instrumentation.finish_meeting_document(meeting_document_url,
+                                                     is_complete)
+        return meeting_document_url, meeting_document_dir, is_complete
+
+    def schedule_retry(meeting_document_url):
+        if retry_queue.schedule(meeting_document_url):
+            _instrumentation.start_meeting_documents(1)
+
+    results = klupung.util.imap_unordered(download, meeting_document_urls,
+                                          max_workers)
+    for meeting_document_url, meeting_document_dir, is_complete in results:
+        if not is_complete and retry_queue is not None:
+            schedule_retry(meeting_document_url)
         yield meeting_document_dir
 
+    if retry_queue is None:
+        return
+
+    while True:
+        meeting_document_url = retry_queue.pop()
+        if meeting_document_url is None:
+            break
+        _, meeting_document_dir, is_complete = download(meeting_document_url)
+        if is_complete:
+            yield meeting_document_dir
+        else:
+            schedule_retry(meeting_document_url)
+
+def download_policymaker(policymaker_url, min_interval=1, burst=1,
+                         force=False, download_dir=os.path.curdir,
+                         max_workers=1, revalidation_store=None,
+                         manifest=None, retry_queue=None, raw=False):
+    return download_policymakers([policymaker_url],
+                                 min_interval=min_interval,
+                                 burst=burst,
+                                 force=force,
+                                 download_dir=download_dir,
+                                 max_workers=max_workers,
+                                 revalidation_store=revalidation_store,
+                                 manifest=manifest,
+                                 retry_queue=retry_queue,
+                                 raw=raw)
+
 _RE_PERSON = re.compile(ur"([A-ZÖÄÅ][a-zöäå]*(?:-[A-ZÖÄÅ][a-zöäå]*)*(?: [A-ZÖÄÅ][a-zöäå]*(?:-[A-ZÖÄÅ][a-zöäå]*)*)+)")
 _RE_DNRO = re.compile(r"Dnro (\d+[\s\xa0\xad]?/\d+)")
 _RE_WS = re.compile(r"[\s\xa0\xad]+")
 _RE_RESOLUTION = re.compile(ur"^[\s\xa0\xad]*Päätös[\s\xa0\xad]+(.*)", re.DOTALL)
 
+# Elements the page parsers below look at, for parse backends which can
+# skip the rest.
+_INDEX_STRAINER = bs4.SoupStrainer("title")
+_COVER_PAGE_STRAINER = bs4.SoupStrainer("table")
+_AGENDA_ITEM_STRAINER = bs4.SoupStrainer("p")
+
 def _trimws(text):
     return _RE_WS.sub(" ", text).strip()
 
-def _parse_agenda_item_resolution(agenda_item_soup):
+def _lap(durations, field, start_time):
+    # Adds the time elapsed since start_time to the duration of the
+    # field and returns the current time.
+    now = time.time()
+    durations[field] = durations.get(field, 0.0) + now - start_time
+    return now
+
+def _is_descendant(tag, ancestor):
+    for parent in tag.parents:
+        if parent is ancestor:
+            return True
+    return False
+
+def _parse_agenda_item_paragraphs(agenda_item_soup, number, durations=None):
+    # Finds the subject, Dnro, preparers, introducers, proposal and
+    # resolution in a single pass over the paragraphs: the text of each
+    # paragraph is extracted and normalized only once and then passed to
+    # each field recognizer which has not found its field yet.
+    # Preparers and introducers are recognized from all paragraphs,
+    # other fields only from the ones in the body. If the soup has no
+    # body, e.g. because only the paragraphs were parsed, all
+    # paragraphs are considered to be in the body. If durations (a
+    # dict) is given, the time spent on each field is added to it.
+    html = agenda_item_soup.html
+    body = html.body if html is not None else None
+    number_text = "%d" % number
+
+    subject = None
+    number_found = False
+    dnro = None
+    preparers = None
+    introducers = None
     resolutions = [(None, None)]
-
     proposal = None
 
-    for p in agenda_item_soup.html.body("p"):
-        resolution_match = _RE_RESOLUTION.match(p.text)
+    profile = durations is not None
+    if profile:
+        lap_time = time.time()
+
+    for p in agenda_item_soup("p"):
+        raw_text = p.text
+        text = _trimws(raw_text)
+        if profile:
+            lap_time = _lap(durations, "text", lap_time)
+
+        if preparers is None and text.startswith("Asian valmisteli"):
+            preparers = _RE_PERSON.findall(text)
+        if profile:
+            lap_time = _lap(durations, "preparers", lap_time)
+
+        if introducers is None and text.startswith("Asian esitteli"):
+            introducers = _RE_PERSON.findall(text)
+        if profile:
+            lap_time = _lap(durations, "introducers", lap_time)
+
+        is_in_body = body is None or _is_descendant(p, body)
+        if profile:
+            lap_time = _lap(durations, "text", lap_time)
+        if not is_in_body:
+            continue
+
+        if subject is None:
+            if not number_found:
+                if text == number_text:
+                    number_found = True
+                elif text.startswith(number_text + " "):
+                    # The paragraph starts with the given agenda item
+                    # number, the subject is nearby. In most cases, the
+                    # subject follows the number within the same
+                    # paragraph.
+                    number_found = True
+                    subject = text[len(number_text) + 1:].strip() or None
+            elif text:
+                # In some rare cases, the subject is the next
+                # non-whitespace paragraph.
+                subject = text
+        if profile:
+            lap_time = _lap(durations, "subject", lap_time)
+
+        if dnro is None:
+            # Some of the agenda items in each meeting are "standard"
+            # agenda items, e.g. opening of the meeting, determination
+            # of quorum, which do not have Dnro.
+            dnro_match = _RE_DNRO.match(text)
+            if dnro_match:
+                dnro = dnro_match.group(1)
+        if profile:
+            lap_time = _lap(durations, "dnro", lap_time)
+
+        resolution_match = _RE_RESOLUTION.match(raw_text)
         if resolution_match:
             resolution = "<p>%s</p>" % _trimws(resolution_match.group(1))
             resolutions.append((proposal, resolution))
             proposal = None
+        if profile:
+            lap_time = _lap(durations, "resolution", lap_time)
+        if resolution_match:
             continue
 
         if "Ehdotus" in p.attrs.get("class", []):
             if proposal is None:
                 proposal = ""
-            continue
+        elif proposal is not None and text:
+            proposal += "<p>%s</p>" % text
+        if profile:
+            lap_time = _lap(durations, "proposal", lap_time)
 
-        if proposal is not None:
-            text = _trimws(p.text)
-            if text:
-                proposal += "<p>%s</p>" % text
+    if dnro == "0/00":
+        dnro = None
 
     # Consider only the last decision. The document can contain multiple
     # proposals if the same issue has been discussed in multiple
     # meetings. The latest is always the last.
-    return resolutions[-1]
-
-def _parse_agenda_item_preparers(agenda_item_soup):
-    preparers = []
-    for text in [_trimws(p.text) for p in agenda_item_soup("p")]:
-        if text.startswith("Asian valmisteli"):
-            preparers.extend(_RE_PERSON.findall(text))
-            break
-    return preparers
-
-def _parse_agenda_item_introducers(agenda_item_soup):
-    introducers = []
-    for text in [_trimws(p.text) for p in agenda_item_soup("p")]:
-        if text.startswith("Asian esitteli"):
-            introducers.extend(_RE_PERSON.findall(text))
-            break
-    return introducers
-
-def _parse_agenda_item_dnro(agenda_item_soup):
-    ps = agenda_item_soup.html.body("p")
-    dnros = []
-    for text in [_trimws(p.text) for p in ps]:
-        dnro_match = _RE_DNRO.match(text)
-        if dnro_match:
-            dnros.append(dnro_match.group(1))
-
-    try:
-        dnro = dnros[0]
-    except IndexError:
-        # Some of the agenda items in each meeting are "standard"
-        # agenda items, e.g. opening of the meeting, determination
-        # of quorum, which do not have Dnro.
-        dnro = None
-
-    if dnro == "0/00":
-        dnro = None
-
-    return dnro
-
-def _parse_agenda_item_subject(agenda_item_soup, number):
-    number_found = False
-    for p in agenda_item_soup.html.body("p"):
-        text = _trimws(p.text)
-        if not number_found:
-            match = re.match(r"%d$|%d " % (number, number), text)
-            if match:
-                # The paragraph starts with the given agenda item
-                # number, the subject is nearby.
-                number_found = True
-
-                # In most cases, the subject follows the number within
-                # the same paragraph.
-                subject_candidate = text[match.end():].strip()
-                if subject_candidate:
-                    return subject_candidate
-        else:
-            # In some rare cases, the subject is the next non-whitespace
-            # paragraph.
-            subject_candidate = text.strip()
-            if subject_candidate:
-                return subject_candidate
-    return None
-
-def _parse_agenda_item(agenda_item_filepath):
-    agenda_item_soup = _make_soup(agenda_item_filepath)
-
-    agenda_item_filename = os.path.basename(agenda_item_filepath)
-    number = int(re.match(r"htmtxt([0-9]+)\.htm", agenda_item_filename).group(1))
-
-    subject = _parse_agenda_item_subject(agenda_item_soup, number)
-    dnro = _parse_agenda_item_dnro(agenda_item_soup)
-    preparers = _parse_agenda_item_preparers(agenda_item_soup)
-    introducers = _parse_agenda_item_introducers(agenda_item_soup)
-    proposal, resolution = _parse_agenda_item_resolution(agenda_item_soup)
+    proposal, resolution = resolutions[-1]
 
     return {
-        "number": number,
-        "dnro": dnro,
-        "preparers": preparers,
-        "introducers": introducers,
         "subject": subject,
-        "resolution": resolution,
+        "dnro": dnro,
+        "preparers": preparers or [],
+        "introducers": introducers or [],
         "proposal": proposal,
+        "resolution": resolution,
         }
 
-def _parse_agenda_items(meeting_document_dirpath):
-    retval = []
+def _parse_agenda_item(meeting_document, agenda_item_filename):
+    durations = None
+    if _instrumentation.profiles_parsing:
+        durations = {}
+        lap_time = time.time()
 
-    agenda_item_filepath_pattern = os.path.join(meeting_document_dirpath, "htmtxt*.htm")
-    for agenda_item_filepath in glob.iglob(agenda_item_filepath_pattern):
-        if os.path.basename(agenda_item_filepath) == _COVER_PAGE_FILENAME:
-            continue
-        agenda_item = _parse_agenda_item(agenda_item_filepath)
-        retval.append(agenda_item)
+    agenda_item_soup = _make_soup(meeting_document.read(agenda_item_filename),
+                                  parse_only=_AGENDA_ITEM_STRAINER)
+    if durations is not None:
+        _lap(durations, "soup", lap_time)
 
-    return retval
+    number = int(re.match(r"htmtxt([0-9]+)\.htm", agenda_item_filename).group(1))
+
+    agenda_item = _parse_agenda_item_paragraphs(agenda_item_soup, number,
+                                                durations)
+    agenda_item["number"] = number
+    _dispose_soup(agenda_item_soup)
+
+    if durations is not None:
+        _instrumentation.record_parse(
+            os.path.join(meeting_document.dirpath, agenda_item_filename),
+            durations)
+
+    return agenda_item
+
+def iter_agenda_item_filenames(filenames):
+    # Yields the names of the agenda item pages among filenames of a
+    # meeting document directory in sorted order, also of pages which
+    # have only been downloaded in raw mode and not cleaned yet.
+    agenda_item_filenames = set()
+    for filename in filenames:
+        if filename.endswith(_RAW_SUFFIX):
+            filename = filename[:-len(_RAW_SUFFIX)]
+        if (fnmatch.fnmatch(filename, "htmtxt*.htm")
+            and filename != _COVER_PAGE_FILENAME):
+            agenda_item_filenames.add(filename)
+    return iter(sorted(agenda_item_filenames))
+
+def _iter_agenda_items(meeting_document):
+    for filename in iter_agenda_item_filenames(meeting_document.namelist()):
+        yield _parse_agenda_item(meeting_document, filename)
 
 def _parse_start_datetime(text):
     pattern = r"(?P<weekday>[a-zA-Z]+)?" \
@@ -363,9 +1291,16 @@ def _parse_start_datetime(text):
 
     return datetime.datetime(year, month, day, hour, minute)
 
-def _parse_cover_page(meeting_document_dirpath):
-    cover_page_filepath = os.path.join(meeting_document_dirpath, _COVER_PAGE_FILENAME)
-    cover_page_soup = _make_soup(cover_page_filepath)
+def _parse_cover_page(meeting_document):
+    profile = _instrumentation.profiles_parsing
+    if profile:
+        durations = {}
+        lap_time = time.time()
+
+    cover_page_soup = _make_soup(meeting_document.read(_COVER_PAGE_FILENAME),
+                                 parse_only=_COVER_PAGE_STRAINER)
+    if profile:
+        lap_time = _lap(durations, "soup", lap_time)
 
     # Find the meeting info marker. Datetimes and such are nearby...
     meeting_info_markertag = cover_page_soup(text=re.compile("KOKOUSTIEDOT"))[0]
@@ -392,6 +1327,7 @@ def _parse_cover_page(meeting_document_dirpath):
         # Fallback to bullet-proof method: get the start time from the
         # directory path. However, it is not as accurate because it is
         # often just a template value.
+        meeting_document_dirpath = meeting_document.dirpath
         year = int(os.path.basename(os.path.dirname(meeting_document_dirpath)))
         dirname = os.path.basename(meeting_document_dirpath)
         day = int(dirname[:2])
@@ -411,31 +1347,162 @@ def _parse_cover_page(meeting_document_dirpath):
             date_text = re.search(r"[0-9]{1,2}\.[0-9]{1,2}\.[0-9]{4}", texts[0]).group()
             publish_datetime = datetime.datetime.strptime(date_text, "%d.%m.%Y")
 
+    _dispose_soup(cover_page_soup)
+
+    if profile:
+        _lap(durations, "cover_page", lap_time)
+        _instrumentation.record_parse(
+            os.path.join(meeting_document.dirpath, _COVER_PAGE_FILENAME),
+            durations)
+
     return {
         "start_datetime": start_datetime,
         "publish_datetime": publish_datetime,
         }
 
-def _parse_meeting_document_type(meeting_document_dirpath):
-    index_filepath = os.path.join(meeting_document_dirpath, "index.htm")
-    index_soup = _make_soup(index_filepath)
+def _parse_meeting_document_type(meeting_document):
+    profile = _instrumentation.profiles_parsing
+    if profile:
+        durations = {}
+        lap_time = time.time()
+
+    index_soup = _make_soup(meeting_document.read("index.htm"),
+                            parse_only=_INDEX_STRAINER)
+    if profile:
+        lap_time = _lap(durations, "soup", lap_time)
+
     title = index_soup("title")[0].text.strip()
+    meeting_document_type = None
     if title.lower().startswith(u"pöytäkirja"):
-        return "minutes"
-    if title.lower().startswith(u"esityslista"):
-        return "agenda"
-    return None
+        meeting_document_type = "minutes"
+    elif title.lower().startswith(u"esityslista"):
+        meeting_document_type = "agenda"
+    _dispose_soup(index_soup)
+
+    if profile:
+        _lap(durations, "type", lap_time)
+        _instrumentation.record_parse(
+            os.path.join(meeting_document.dirpath, "index.htm"), durations)
+
+    return meeting_document_type
 
 def parse_meeting_document_origin_id(meeting_document_dirpath):
     return "/".join(meeting_document_dirpath.split(os.path.sep)[-3:])
 
-def parse_meeting_document(meeting_document_dirpath):
-    meeting_document_type = _parse_meeting_document_type(meeting_document_dirpath)
-
-    origin_url_filepath = os.path.join(meeting_document_dirpath, "origin_url")
-    if os.path.exists(origin_url_filepath):
-        with open(origin_url_filepath) as f:
-            origin_url = f.readline().strip()
+def fingerprint_meeting_document(meeting_document_dirpath, filenames=None):
+    # Returns the fingerprint of the files parse_meeting_document()
+    # parses, it changes whenever the result of parse_meeting_document()
+    # can change. The result has the fingerprint too. Packs have it
+    # without reading their pages, directories have to read them. See
+    # open_meeting_document() for filenames.
+    with open_meeting_document(meeting_document_dirpath,
+                               filenames) as meeting_document:
+        return meeting_document.content_key()
+
+def get_meeting_document_keys(meeting_document_dirpath, filenames=None,
+                              stat_key=None):
+    # Returns (stat_key, fingerprint) of the meeting document. The stat
+    # key is a key of the names, sizes and mtimes of the files the
+    # fingerprint is computed from, cheap to compute also for
+    # directories. If it equals the given stat_key, a stat key taken
+    # earlier, the files have not changed since and fingerprint is None
+    # without reading them. The result of parse_meeting_document() has
+    # both keys too. See open_meeting_document() for filenames.
+    with open_meeting_document(meeting_document_dirpath,
+                               filenames) as meeting_document:
+        if stat_key is not None and meeting_document.stat_key() == stat_key:
+            return stat_key, None
+        fingerprint = meeting_document.content_key()
+        # Reading the files may have cleaned raw pages.
+        return meeting_document.stat_key(), fingerprint
+
+def parse_meeting_document(meeting_document_dirpath, parse_cache=None,
+                           filenames=None):
+    # If parse_cache (klupung.parsecache.ParseCache) is given, the
+    # result is looked up from it first and stored to it after parsing.
+    # See open_meeting_document() for filenames.
+    with open_meeting_document(meeting_document_dirpath,
+                               filenames) as meeting_document:
+        if parse_cache is None:
+            return _add_meeting_document_keys(
+                meeting_document, _parse_meeting_document(meeting_document))
+        return _parse_meeting_document_cached(meeting_document, parse_cache)
+
+def _add_meeting_document_keys(meeting_document, meeting_document_data):
+    # Keys are taken after the pages have been read, from the pages
+    # read, and after raw pages have been cleaned. Agenda items parsed
+    # lazily are read for the fingerprint and kept until they are
+    # parsed.
+    meeting_document_data["fingerprint"] = meeting_document.content_key()
+    meeting_document_data["stat_key"] = meeting_document.stat_key()
+    return meeting_document_data
+
+def _parse_meeting_document_cached(meeting_document, parse_cache):
+    # A cached result is used if the sizes and mtimes of the files are
+    # the same as when it was parsed. If they are not, the files are
+    # read and the cached result is still used if their contents are
+    # the same, e.g. if the files have been copied or packed, or raw
+    # pages have been cleaned.
+    origin_id = parse_meeting_document_origin_id(meeting_document.dirpath)
+
+    keys = parse_cache.get_keys(origin_id)
+    if keys is not None:
+        stat_key, content_key = keys
+        meeting_document_data = None
+        if meeting_document.stat_key() == stat_key:
+            meeting_document_data = parse_cache.get(origin_id)
+        elif meeting_document.content_key() == content_key:
+            parse_cache.update_stat_key(origin_id, meeting_document.stat_key())
+            meeting_document_data = parse_cache.get(origin_id)
+        if meeting_document_data is not None:
+            # The cached result has the stat key it was parsed with.
+            meeting_document_data["stat_key"] = meeting_document.stat_key()
+            return meeting_document_data
+
+    meeting_document_data = _add_meeting_document_keys(
+        meeting_document, _parse_meeting_document(meeting_document))
+
+    # The fingerprint is the content key.
+    parse_cache.update(origin_id, meeting_document_data["stat_key"],
+                       meeting_document_data["fingerprint"],
+                       meeting_document_data)
+
+    return meeting_document_data
+
+def iter_meeting_documents(dirpath, policymakers=None, since=None,
+                           parse_cache=None):
+    # Yields meeting documents in dirpath, see
+    # iter_meeting_document_dirpaths(), parsed like with
+    # parse_meeting_document() but one at a time, and with
+    # "agenda_items" as an iterator which parses agenda items as they
+    # are consumed (unless the meeting document is found from
+    # parse_cache). The files of a meeting document stay open until the
+    # next one is requested, so its agenda items must be consumed
+    # before that. Exceptions raised while parsing are propagated, use
+    # iter_meeting_document_dirpaths() and parse_meeting_document() to
+    # handle them document by document.
+    for meeting_document_dirpath, filenames in iter_meeting_document_listings(
+        dirpath, policymakers=policymakers, since=since):
+        with open_meeting_document(meeting_document_dirpath,
+                                   filenames) as meeting_document:
+            if parse_cache is None:
+                meeting_document_data = _add_meeting_document_keys(
+                    meeting_document,
+                    _parse_meeting_document(meeting_document, lazy=True))
+            else:
+                meeting_document_data = _parse_meeting_document_cached(
+                    meeting_document, parse_cache)
+                meeting_document_data["agenda_items"] = iter(
+                    meeting_document_data["agenda_items"])
+            yield meeting_document_data
+
+def _parse_meeting_document(meeting_document, lazy=False):
+    meeting_document_dirpath = meeting_document.dirpath
+
+    meeting_document_type = _parse_meeting_document_type(meeting_document)
+
+    if "origin_url" in meeting_document.namelist():
+        origin_url = meeting_document.read("origin_url").partition("\n")[0].strip()
     else:
         origin_url = ""
 
@@ -445,15 +1512,18 @@ def parse_meeting_document(meeting_document_dirpath):
 
     origin_id = parse_meeting_document_origin_id(meeting_document_dirpath)
 
-    meeting_document = {
+    meeting_document_data = {
         "policymaker_abbreviation": policymaker_abbreviation,
         "origin_url": origin_url,
         "origin_id": origin_id,
         "type": meeting_document_type,
         }
 
-    meeting_document.update(_parse_cover_page(meeting_document_dirpath))
+    meeting_document_data.update(_parse_cover_page(meeting_document))
 
-    meeting_document["agenda_items"] = _parse_agenda_items(meeting_document_dirpath)
+    agenda_items = _iter_agenda_items(meeting_document)
+    if not lazy:
+        agenda_items = list(agenda_items)
+    meeting_document_data["agenda_items"] = agenda_items
 
-    return meeting_document
+    return meeting_document_data
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Read-only soups of lxml trees.
+
+Building a BeautifulSoup tree costs several times more than parsing the
+page with lxml. The soups here wrap lxml elements in objects which
+provide the small part of the BeautifulSoup API the KTweb page parsers
+use: searching tags by name and strings by regex, `text`, `attrs`,
+`parent` and `parents`. Strings and attribute values are as
+BeautifulSoup would give them with its lxml tree builder.
+
+"""
+
+from __future__ import absolute_import
+
+import re
+
+import bs4
+import bs4.builder
+import lxml.etree
+
+_CDATA_LIST_ATTRIBUTES = bs4.builder.HTMLTreeBuilder.cdata_list_attributes
+_PRESERVE_WHITESPACE_TAGS = bs4.builder.HTMLTreeBuilder.preserve_whitespace_tags
+_ASCII_SPACES = frozenset(bs4.BeautifulSoup.ASCII_SPACES)
+_RE_NONWHITESPACE = re.compile(r"\S+")
+
+_parser = lxml.etree.HTMLParser()
+
+def _collapse(string, preserve_whitespace):
+    # Like BeautifulSoup, replace strings consisting only of ASCII
+    # spaces with a single space or newline.
+    if preserve_whitespace:
+        return string
+    for c in string:
+        if c not in _ASCII_SPACES:
+            return string
+    if "\n" in string:
+        return u"\n"
+    return u" "
+
+class NavigableString(unicode):
+    """A string in the soup."""
+
+    def __new__(cls, value, parent):
+        string = unicode.__new__(cls, value)
+        string.parent = parent
+        return string
+
+class _Node(object):
+
+    def __getattr__(self, name):
+        # soup.html, tag.body etc. find the first tag with the name.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.find(name)
+
+    def __call__(self, name=None, text=None):
+        return self.find_all(name, text)
+
+    def find(self, name):
+        for tag in self._iter_tags(name):
+            return tag
+        return None
+
+    def find_all(self, name=None, text=None):
+        """Return tags with `name` or strings matching regex `text`."""
+        if text is not None:
+            return [string for string in self._iter_strings(False)
+                    if text.search(string)]
+        return list(self._iter_tags(name))
+
+    @property
+    def parents(self):
+        node = self.parent
+        while node is not None:
+            yield node
+            node = node.parent
+
+    @property
+    def text(self):
+        return u"".join(self._iter_strings(True))
+
+class Tag(_Node):
+    """A tag in the soup, wrapping an lxml element."""
+
+    def __init__(self, soup, element, preserve_whitespace):
+        self._soup = soup
+        self._element = element
+        self._preserve_whitespace = (preserve_whitespace or
+                                     element.tag in _PRESERVE_WHITESPACE_TAGS)
+        self.name = element.tag
+        self._attrs = None
+
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            list_attrs = (_CDATA_LIST_ATTRIBUTES["*"] +
+                          _CDATA_LIST_ATTRIBUTES.get(self.name, []))
+            attrs = {}
+            for key, value in self._element.attrib.items():
+                if key in list_attrs:
+                    value = _RE_NONWHITESPACE.findall(value)
+                attrs[key] = value
+            self._attrs = attrs
+        return self._attrs
+
+    @property
+    def parent(self):
+        if self._soup._is_top_element(self._element):
+            return self._soup
+        return self._soup._get_tag(self._element.getparent())
+
+    def _iter_tags(self, name):
+        for element in self._element.iterdescendants(name):
+            yield self._soup._get_tag(element)
+
+    def _iter_strings(self, text_only):
+        # Yields strings in document order. Text of comments and
+        # processing instructions is not part of text, like in
+        # BeautifulSoup.
+        element = self._element
+        preserve_whitespace = self._preserve_whitespace
+        if element.text:
+            yield NavigableString(_collapse(element.text, preserve_whitespace),
+                                  self)
+        for child in element:
+            if isinstance(child.tag, basestring):
+                for string in self._soup._get_tag(child)._iter_strings(text_only):
+                    yield string
+            elif child.tag is lxml.etree.Comment and not text_only and child.text:
+                yield NavigableString(child.text, self)
+            if child.tail:
+                yield NavigableString(_collapse(child.tail, preserve_whitespace),
+                                      self)
+
+class LxmlSoup(_Node):
+    """Soup of the top-level elements of an lxml tree matching a strainer.
+
+    If `parse_only` is a bs4.SoupStrainer, only the elements with its
+    name are in the soup, without their ancestors, like in a
+    BeautifulSoup built with the strainer. Otherwise the whole tree is.
+
+    """
+
+    name = u"[document]"
+    parent = None
+
+    def __init__(self, markup, parse_only=None):
+        self._tags_by_element = {}
+        root = lxml.etree.fromstring(markup, _parser) if markup.strip() else None
+        if root is None:
+            self._top_elements = []
+        elif parse_only is None or parse_only.name is None:
+            self._top_elements = [root]
+        else:
+            name = parse_only.name
+            self._top_elements = [
+                element for element in root.iter(name)
+                if next(element.iterancestors(name), None) is None]
+        self._top_element_set = set(self._top_elements)
+
+    def decompose(self):
+        """Forget the tree, like BeautifulSoup.decompose().
+
+        Tags refer to the soup and the soup to its tags, so the tree
+        would otherwise stay in memory until the cyclic garbage
+        collector frees it.
+
+        """
+        self._tags_by_element = {}
+        self._top_elements = []
+        self._top_element_set = set()
+
+    def _is_top_element(self, element):
+        return element in self._top_element_set
+
+    def _get_tag(self, element):
+        # Each element has one tag object, so tags can be compared by
+        # identity like BeautifulSoup tags.
+        try:
+            return self._tags_by_element[element]
+        except KeyError:
+            preserve_whitespace = False
+            if not self._is_top_element(element):
+                preserve_whitespace = self._get_tag(
+                    element.getparent())._preserve_whitespace
+            tag = Tag(self, element, preserve_whitespace)
+            self._tags_by_element[element] = tag
+            return tag
+
+    def _iter_tags(self, name):
+        for top_element in self._top_elements:
+            if top_element.tag == name:
+                yield self._get_tag(top_element)
+            for tag in self._get_tag(top_element)._iter_tags(name):
+                yield tag
+
+    def _iter_strings(self, text_only):
+        for top_element in self._top_elements:
+            for string in self._get_tag(top_element)._iter_strings(text_only):
+                yield string
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import os.path
+import sqlite3
+import threading
+import time
+
+STATUSES = (
+    STATUS_PENDING,
+    STATUS_OK,
+    STATUS_FAILED,
+    ) = (
+    "pending",
+    "ok",
+    "failed",
+    )
+
+PageEntry = collections.namedtuple("PageEntry", [
+        "url",
+        "filepath",
+        "sha1",
+        "status",
+        "attempt_count",
+        "fetch_time",
+        "error",
+        ])
+
+MeetingDocumentEntry = collections.namedtuple("MeetingDocumentEntry", [
+        "url",
+        "dirpath",
+        "index_sha1",
+        "status",
+        "fetch_time",
+        ])
+
+def sha1_file(filepath):
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class CrawlManifest(object):
+    """Persistent record of downloaded pages and meeting documents.
+
+    Each page has its local filepath, the SHA-1 of its written
+    contents, status, the number of failed attempts since the latest
+    successful fetch, the time of the latest fetch attempt and the
+    error of the latest failed attempt. Each meeting document has its
+    status and the SHA-1 of its index at the time all of its pages
+    were downloaded successfully.
+
+    The manifest can be shared between threads.
+
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS page (
+                    url TEXT PRIMARY KEY,
+                    filepath TEXT NOT NULL,
+                    sha1 TEXT,
+                    status TEXT NOT NULL,
+                    attempt_count INTEGER NOT NULL DEFAULT 0,
+                    fetch_time REAL,
+                    error TEXT
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS meeting_document (
+                    url TEXT PRIMARY KEY,
+                    dirpath TEXT,
+                    index_sha1 TEXT,
+                    status TEXT NOT NULL,
+                    fetch_time REAL
+                )""")
+
+    def get_page(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, filepath, sha1, status, attempt_count, "
+                "fetch_time, error FROM page WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        return PageEntry(*row)
+
+    def is_page_downloaded(self, url, *filepaths):
+        page = self.get_page(url)
+        if page is not None:
+            return page.status == STATUS_OK
+
+        # Pages downloaded before the manifest was taken into use are
+        # recorded as they are found from any of the filepaths, the
+        # filesystem needs to be consulted only once per such page.
+        for filepath in filepaths:
+            if os.path.exists(filepath):
+                self.mark_page_ok(url, filepath, sha1_file(filepath))
+                return True
+
+        return False
+
+    def mark_page_ok(self, url, filepath, sha1=None):
+        # If sha1 is None, the page was found unchanged and the
+        # previous hash is kept.
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page "
+                "(url, filepath, sha1, status, attempt_count, fetch_time, error) "
+                "VALUES (?, ?, COALESCE(?, (SELECT sha1 FROM page WHERE url = ?)), "
+                "?, 0, ?, NULL)",
+                (url, filepath, sha1, url, STATUS_OK, time.time()))
+
+    def mark_page_failed(self, url, filepath, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page "
+                "(url, filepath, sha1, status, attempt_count, fetch_time, error) "
+                "VALUES (?, ?, (SELECT sha1 FROM page WHERE url = ?), ?, "
+                "COALESCE((SELECT attempt_count FROM page WHERE url = ?), 0) + 1, "
+                "?, ?)",
+                (url, filepath, url, STATUS_FAILED, url, time.time(), error))
+
+    def iter_failed_pages(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, filepath, sha1, status, attempt_count, "
+                "fetch_time, error FROM page WHERE status = ? ORDER BY url",
+                (STATUS_FAILED,)).fetchall()
+        for row in rows:
+            yield PageEntry(*row)
+
+    def get_meeting_document(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, dirpath, index_sha1, status, fetch_time "
+                "FROM meeting_document WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return MeetingDocumentEntry(*row)
+
+    def is_meeting_document_complete(self, url):
+        meeting_document = self.get_meeting_document(url)
+        return (meeting_document is not None
+                and meeting_document.status == STATUS_OK)
+
+    def mark_meeting_document(self, url, status, dirpath=None,
+                              index_sha1=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meeting_document "
+                "(url, dirpath, index_sha1, status, fetch_time) "
+                "VALUES (?, "
+                "COALESCE(?, (SELECT dirpath FROM meeting_document WHERE url = ?)), "
+                "?, ?, ?)",
+                (url, dirpath, url, index_sha1, status, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
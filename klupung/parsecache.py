@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import cPickle
+import sqlite3
+import threading
+import zlib
+
+class ParseCache(object):
+    """Persistent cache of parsed meeting documents.
+
+    Keeps the parse result of each meeting document, by origin id,
+    along with two keys of the files it was parsed from: a stat key of
+    their sizes and mtimes, which is cheap to compute, and a content
+    key of their contents, which still matches after the files have
+    been touched or copied without changing them. See
+    klupung.ktweb.parse_meeting_document(). Results are stored as
+    compressed pickles.
+
+    The cache can be shared between threads. Multiple processes can
+    use the same cache file, each with its own ParseCache. The cache
+    file is used in WAL mode so that readers do not block the writer.
+    If the cache file stays locked for longer than `timeout` seconds
+    anyway, reads are misses and writes are dropped: the cache only
+    saves work, failing to use it must not fail the parse.
+
+    """
+
+    def __init__(self, filepath, timeout=60):
+        self._conn = sqlite3.connect(filepath, timeout=timeout,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS parse_result (
+                    origin_id TEXT PRIMARY KEY,
+                    stat_key TEXT NOT NULL,
+                    content_key TEXT NOT NULL,
+                    data BLOB NOT NULL
+                )""")
+
+    def get_keys(self, origin_id):
+        """Return (stat_key, content_key) of `origin_id` or None."""
+        try:
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT stat_key, content_key FROM parse_result "
+                    "WHERE origin_id = ?", (origin_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+    def get(self, origin_id):
+        """Return the parse result of `origin_id` or None."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT data FROM parse_result WHERE origin_id = ?",
+                    (origin_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        return cPickle.loads(zlib.decompress(row[0]))
+
+    def update(self, origin_id, stat_key, content_key, data):
+        data = sqlite3.Binary(zlib.compress(
+                cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)))
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO parse_result "
+                    "(origin_id, stat_key, content_key, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (origin_id, stat_key, content_key, data))
+        except sqlite3.OperationalError:
+            pass
+
+    def update_stat_key(self, origin_id, stat_key):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE parse_result SET stat_key = ? WHERE origin_id = ?",
+                    (stat_key, origin_id))
+        except sqlite3.OperationalError:
+            pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import random
+import time
+
+class RetryQueue(object):
+    """Schedule of failed items to be retried with exponential backoff.
+
+    The n:th retry of an item is due after `initial_delay` * 2**(n-1)
+    seconds, but at most after `max_delay` seconds. Each delay is
+    shortened by a random fraction of at most `jitter` to keep retries
+    of items which failed together from hitting the server together
+    again. Items which have been attempted `max_attempts` times in
+    total are not scheduled anymore but put to `dead_letters` instead.
+
+    """
+
+    def __init__(self, max_attempts=5, initial_delay=10, max_delay=600,
+                 jitter=0.5):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.dead_letters = []
+        self._attempt_counts = {}
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, item):
+        """Schedule a retry of `item` which has just failed.
+
+        Returns False if the item has run out of attempts and was put
+        to dead letters instead.
+
+        """
+
+        attempt_count = self._attempt_counts.get(item, 0) + 1
+        self._attempt_counts[item] = attempt_count
+
+        if attempt_count >= self.max_attempts:
+            self.dead_letters.append(item)
+            return False
+
+        delay = min(self.initial_delay * 2 ** (attempt_count - 1),
+                    self.max_delay)
+        delay *= 1 - self.jitter * random.random()
+
+        # The counter breaks ties between items due at the same time,
+        # items themselves are never compared.
+        heapq.heappush(self._heap,
+                       (time.time() + delay, next(self._counter), item))
+        return True
+
+    def pop(self):
+        """Wait until the next retry is due and return its item.
+
+        Returns None if there is nothing scheduled.
+
+        """
+
+        if not self._heap:
+            return None
+        due_time, _, item = heapq.heappop(self._heap)
+        time.sleep(max(due_time - time.time(), 0))
+        return item
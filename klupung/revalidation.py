@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import json
+import sqlite3
+import threading
+
+class RevalidationStore(object):
+    """Persistent store of HTTP cache validators.
+
+    Keeps the ETag and Last-Modified values of the latest successful
+    response of each URL, so that the next request of the same URL can
+    be made conditional. An optional JSON-serializable payload can be
+    stored alongside the validators for callers which need to know
+    what the unchanged response meant to them without downloading it
+    again.
+
+    The store can be shared between threads.
+
+    """
+
+    def __init__(self, filepath):
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS validator (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    payload TEXT
+                )""")
+
+    def get(self, url):
+        """Return (etag, last_modified, payload) of `url` or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, payload FROM validator "
+                "WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, payload = row
+        if payload is not None:
+            payload = json.loads(payload)
+        return etag, last_modified, payload
+
+    def update(self, url, etag, last_modified, payload=None):
+        if etag is None and last_modified is None:
+            # The server does not support conditional requests for
+            # this URL, there is nothing to remember.
+            self.discard(url)
+            return
+        if payload is not None:
+            payload = json.dumps(payload)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO validator "
+                "(url, etag, last_modified, payload) VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, payload))
+
+    def discard(self, url):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM validator WHERE url = ?", (url,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# KlupuNG
+# Copyright (C) 2014 Koodilehto Osk <http://koodilehto.fi>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+
+import errno
+import os
+import os.path
+import tempfile
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+def write_to_file_atomically(filepath, data):
+    # Make the target directory with all the leading components, do not
+    # care whether the the directory exists or not.
+    dirpath = os.path.dirname(filepath)
+    try:
+        os.makedirs(dirpath)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+
+    # Write the contents to a temporary file first, because the
+    # existence of the real filepath can be used as an indicator to not
+    # re-download and re-write the file again but just read its current
+    # value. Writing to a temporary file and then renaming it to its
+    # final name guarantees that the contents of the final path is
+    # always complete.
+    tmp_file = tempfile.NamedTemporaryFile(dir=dirpath, delete=False)
+    try:
+        tmp_file.write(data)
+        tmp_file.close()
+    except:
+        # Something went wrong when writing to the file. Signal
+        # interrupted, fs failed, anything.
+        try:
+            tmp_file.close()
+        finally:
+            os.remove(tmp_file.name)
+        raise
+    else:
+        try:
+            # File written, now let's move it to its final path.
+            os.rename(tmp_file.name, filepath)
+        except:
+            os.remove(tmp_file.name)
+            raise
+
+# How long the consumer of imap_unordered() waits for a result at a
+# time. Waiting without a timeout cannot be interrupted with Ctrl-C in
+# Python 2, hence the (otherwise pointless) finite timeout.
+_POOL_POLL_TIMEOUT = 60
+
+def imap_unordered(func, iterable, max_workers):
+    # Like ThreadPool.imap_unordered() with max_workers threads, or
+    # itertools.imap() in the calling thread if max_workers is 1.
+    if max_workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    pool = ThreadPool(max_workers)
+    try:
+        results = pool.imap_unordered(func, iterable)
+        while True:
+            try:
+                result = results.next(_POOL_POLL_TIMEOUT)
+            except TimeoutError:
+                continue
+            except StopIteration:
+                break
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
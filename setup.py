@@ -15,12 +15,14 @@ setup(name='klupung',
       license='AGPLv3+',
       packages=['klupung', 'klupung.flask'],
       scripts=[
+        "bin/klupung-clean-ktweb",
         "bin/klupung-dbimport-categories",
         "bin/klupung-dbimport-ktweb",
         "bin/klupung-dbimport-ktweb-geometries",
         "bin/klupung-dbimport-policymakers",
         "bin/klupung-dbinit",
         "bin/klupung-download-ktweb",
+        "bin/klupung-pack-ktweb",
         "bin/klupung-stupid-apiserver",
         "bin/klupung-geocode-ktweb",
         ],